@@ -1,23 +1,40 @@
 import asyncio
-import json
+import orjson
 import csv
 import io
+import logging
 import os
+from contextlib import asynccontextmanager, suppress
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Service modules log through `logging`; set LOG_LEVEL=DEBUG to see per-page crawl/LLM details
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING").upper(), format="%(levelname)s %(name)s: %(message)s")
+
 from fastapi import FastAPI, Request
 from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, TypeAdapter
+from typing import AsyncIterator, List
 
 from models import SearchRequest, Company, EnrichRequest
 from services.searxng import search_google
 from services.crawler import process_url_flow
+from services.http_session import close_session
+from services.openai_client import close_clients
+from services.process_pool import shutdown_process_pool
+from services.result_store import create_result, add_results, get_results
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release pooled connections held by the shared aiohttp session and OpenAI clients
+    await close_session()
+    await close_clients()
+    shutdown_process_pool()
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -27,8 +44,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Store results in memory temporarily for download (In production, use a DB)
-last_search_results: List[Company] = []
+# Bulk validator for company dicts posted by the frontend
+COMPANY_LIST_ADAPTER = TypeAdapter(List[Company])
+
+# Max number of start URLs crawled at the same time per /search request
+CRAWL_CONCURRENCY = 8
+
+# Max number of concurrent SearxNG lookups / LLM enrichment calls per /enrich request
+ENRICH_SEARCH_CONCURRENCY = 12
+ENRICH_CONCURRENCY = 10
+
+# Disable proxy buffering (Nginx/Railway edge) so each event is delivered as soon as it's yielded
+SSE_HEADERS = {"X-Accel-Buffering": "no", "Cache-Control": "no-cache", "Connection": "keep-alive"}
+
+# Idle time after which a comment frame is sent so proxies don't drop long-running streams
+SSE_KEEPALIVE_SECONDS = 15
+
+def sse_event(payload: dict) -> str:
+    """
+    Formats one Server-Sent Events data frame.
+    """
+    return f"data: {orjson.dumps(payload).decode()}\n\n"
+
+async def with_keepalive(events: AsyncIterator[str], interval: float = SSE_KEEPALIVE_SECONDS) -> AsyncIterator[str]:
+    """
+    Re-yields SSE frames from `events`, inserting a ": keep-alive" comment
+    whenever no event arrives within `interval` seconds.
+    """
+    next_event = asyncio.ensure_future(events.__anext__())
+    try:
+        while True:
+            done, _ = await asyncio.wait({next_event}, timeout=interval)
+            if not done:
+                yield ": keep-alive\n\n"
+                continue
+            try:
+                event = next_event.result()
+            except StopAsyncIteration:
+                return
+            yield event
+            next_event = asyncio.ensure_future(events.__anext__())
+    finally:
+        # Client went away (or stream ended): stop the producer and let its cleanup run
+        next_event.cancel()
+        with suppress(BaseException):
+            await next_event
+        await events.aclose()
 
 @app.get("/")
 async def health_check():
@@ -46,71 +107,110 @@ async def search_endpoint(request: SearchRequest):
     country = request.country
     
     async def event_generator():
-        global last_search_results
-        last_search_results = []
+        # Results are stored per run; the client downloads them by this id
+        result_id = create_result()
+        total_companies = 0
+        yield sse_event({'type': 'result_id', 'result_id': result_id})
         
         # 1. Search
         # Build search query with country if provided
         search_query = f"{query} {country}" if country else query
-        yield f"data: {json.dumps({'type': 'status', 'message': f'Searching for: {search_query}'})}\n\n"
+        yield sse_event({'type': 'status', 'message': f'Searching for: {search_query}'})
         
-        # Run SearxNG in a thread pool (since requests is blocking)
-        search_results = await asyncio.to_thread(search_google, search_query, request.limit)
+        # Query SearxNG over the shared aiohttp session
+        search_results = await search_google(search_query, request.limit)
         
         if not search_results:
-            yield f"data: {json.dumps({'type': 'status', 'message': 'No URLs found from search'})}\n\n"
-            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+            yield sse_event({'type': 'status', 'message': 'No URLs found from search'})
+            yield sse_event({'type': 'done'})
             return
 
-        yield f"data: {json.dumps({'type': 'status', 'message': f'Found {len(search_results)} candidates. filtering with LLM...'})}\n\n"
+        yield sse_event({'type': 'status', 'message': f'Found {len(search_results)} candidates. filtering with LLM...'})
         
         # Filter with LLM
         from services.llm_filter import filter_search_results
-        urls = await asyncio.to_thread(filter_search_results, search_results, search_query)
+        urls = await filter_search_results(search_results, search_query)
         
-        yield f"data: {json.dumps({'type': 'status', 'message': f'LLM selected {len(urls)} relevant URLs. Starting crawl...'})}\n\n"
+        yield sse_event({'type': 'status', 'message': f'LLM selected {len(urls)} relevant URLs. Starting crawl...'})
         
-        # 2. Process each URL
+        # 2. Process URLs concurrently; companies are streamed as the LLM extracts them
+        semaphore = asyncio.Semaphore(CRAWL_CONCURRENCY)
+        # ("company", url, Company) while extracting, then ("done", url, companies, error) per URL
+        events: asyncio.Queue = asyncio.Queue()
+        # Pages crawled by any flow of this search, so overlapping directories aren't fetched twice
+        visited_urls: set = set()
+
+        async def crawl_one(url: str):
+            async with semaphore:
+                try:
+                    companies = await process_url_flow(url, search_query, lambda c: events.put_nowait(("company", url, c)), visited_urls)
+                    events.put_nowait(("done", url, companies, None))
+                except Exception as e:
+                    events.put_nowait(("done", url, [], e))
+
         for url in urls:
-            yield f"data: {json.dumps({'type': 'status', 'message': f'Checking URL: {url}'})}\n\n"
-            
-            # Check Relevance & Extract
-            try:
-                companies = await asyncio.to_thread(process_url_flow, url, search_query)
-                
-                if companies:
-                     yield f"data: {json.dumps({'type': 'status', 'message': f'Found {len(companies)} companies on {url}'})}\n\n"
-                     for company in companies:
-                         last_search_results.append(company)
-                         yield f"data: {json.dumps({'type': 'company', 'data': company.dict()})}\n\n"
-                else:
-                    yield f"data: {json.dumps({'type': 'status', 'message': f'Skipped or no data: {url}'})}\n\n"
+            yield sse_event({'type': 'status', 'message': f'Checking URL: {url}'})
+
+        tasks = [asyncio.create_task(crawl_one(url)) for url in urls]
+        pending = len(tasks)
+        try:
+            while pending:
+                event = await events.get()
 
-            except Exception as e:
-                yield f"data: {json.dumps({'type': 'error', 'message': f'Error crawling {url}: {str(e)}'})}\n\n"
+                if event[0] == "company":
+                    company = event[2]
+                    add_results(result_id, [company])
+                    total_companies += 1
+                    yield sse_event({'type': 'company', 'data': company.model_dump()})
+                    continue
+
+                _, url, companies, error = event
+                pending -= 1
+                if error is not None:
+                    yield sse_event({'type': 'error', 'message': f'Error crawling {url}: {str(error)}'})
+                elif companies:
+                    yield sse_event({'type': 'status', 'message': f'Found {len(companies)} companies on {url}'})
+                else:
+                    yield sse_event({'type': 'status', 'message': f'Skipped or no data: {url}'})
+        finally:
+            # Client disconnected or generator closed early: stop outstanding crawls
+            for task in tasks:
+                task.cancel()
         
-        yield f"data: {json.dumps({'type': 'status', 'message': f'✅ Crawling completed! Found {len(last_search_results)} companies total.'})}\n\n"
-        yield f"data: {json.dumps({'type': 'done'})}\n\n"
+        yield sse_event({'type': 'status', 'message': f'✅ Crawling completed! Found {total_companies} companies total.'})
+        yield sse_event({'type': 'done'})
 
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(with_keepalive(event_generator()), media_type="text/event-stream", headers=SSE_HEADERS)
+
+class _CsvLine:
+    """
+    File-like sink for csv.writer: write() returns the formatted row instead of buffering it,
+    so writer.writerow() yields one CSV line at a time.
+    """
+    def write(self, line: str) -> str:
+        return line
 
-@app.get("/download/{format}")
-def download_results(format: str):
+@app.get("/download/{result_id}/{format}")
+def download_results(result_id: str, format: str):
     """
-    Download the last search results as CSV or JSON.
+    Download the results of a search/enrich run as CSV or JSON.
     """
+    results = get_results(result_id)
+    if results is None:
+        return {"error": "Unknown or expired result id"}
+
     if format == "json":
-        data = json.dumps([c.dict() for c in last_search_results], indent=2)
-        return StreamingResponse(io.StringIO(data), media_type="application/json", headers={"Content-Disposition": "attachment; filename=companies.json"})
+        data = orjson.dumps([c.model_dump() for c in results], option=orjson.OPT_INDENT_2)
+        return StreamingResponse(io.BytesIO(data), media_type="application/json", headers={"Content-Disposition": "attachment; filename=companies.json"})
     
     elif format == "csv":
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["Name", "Website", "Description", "Email", "Phone", "Address", "Source URL"])
-        for c in last_search_results:
-            writer.writerow([c.name, c.website, c.description, c.email, c.phone, c.address, c.source_url])
-        output.seek(0)
-        return StreamingResponse(output, media_type="text/csv", headers={"Content-Disposition": "attachment; filename=companies.csv"})
+        def row_iter():
+            line = _CsvLine()
+            writer = csv.writer(line)
+            yield writer.writerow(["Name", "Website", "Description", "Email", "Phone", "Address", "Source URL"])
+            for c in results:
+                yield writer.writerow([c.name, c.website, c.description, c.email, c.phone, c.address, c.source_url])
+        return StreamingResponse(row_iter(), media_type="text/csv", headers={"Content-Disposition": "attachment; filename=companies.csv"})
     
     return {"error": "Invalid format"}
 
@@ -122,58 +222,47 @@ async def enrich_endpoint(request: EnrichRequest):
     Streams progress updates.
     """
     async def event_generator():
-        global last_search_results
+        result_id = create_result()
+        yield sse_event({'type': 'result_id', 'result_id': result_id})
         
         # Convert dicts to Company objects
-        from services.enrichment import deduplicate_by_name, enrich_company_details
-        from services.searxng import search_google
+        from services.enrichment import deduplicate_by_name, enrich_company
         
-        companies = [Company(**c) for c in request.companies]
+        companies = COMPANY_LIST_ADAPTER.validate_python(request.companies)
         
-        yield f"data: {json.dumps({'type': 'status', 'message': f'Starting enrichment for {len(companies)} companies...'})}\\n\\n"
+        yield sse_event({'type': 'status', 'message': f'Starting enrichment for {len(companies)} companies...'})
         
         # Step 1: Deduplicate
         unique_companies = deduplicate_by_name(companies)
-        yield f"data: {json.dumps({'type': 'status', 'message': f'Deduplicated to {len(unique_companies)} unique companies'})}\\n\\n"
+        yield sse_event({'type': 'status', 'message': f'Deduplicated to {len(unique_companies)} unique companies'})
         
-        # Step 2 & 3: Enrich each
+        # Step 2 & 3: All searches start up front; each LLM enrichment starts as its search completes
         enriched_companies = []
-        
-        for idx, company in enumerate(unique_companies):
-            yield f"data: {json.dumps({'type': 'status', 'message': f'Enriching {idx+1}/{len(unique_companies)}: {company.name}'})}\\n\\n"
-            
-            # Search for company contact info (including country if provided)
-            if request.country:
-                search_query = f"{company.name} {request.country} contact information"
-            else:
-                search_query = f"{company.name} contact information"
-            search_results = await asyncio.to_thread(search_google, search_query, 40)
-            snippets = [result.get("content", "") for result in search_results if result.get("content")]
-            
-            if not snippets:
-                yield f"data: {json.dumps({'type': 'status', 'message': f'  No search results for {company.name}'})}\\n\\n"
+        search_limit = asyncio.Semaphore(ENRICH_SEARCH_CONCURRENCY)
+        llm_limit = asyncio.Semaphore(ENRICH_CONCURRENCY)
+
+        tasks = [asyncio.create_task(enrich_company(c, request.country, search_limit, llm_limit)) for c in unique_companies]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                company, found = await fut
                 enriched_companies.append(company)
-                continue
-            
-            # LLM enrichment
-            enriched_data = await asyncio.to_thread(enrich_company_details, company.name, snippets)
-            
-            # Merge enriched data
-            company.email = enriched_data.get("email") or company.email
-            company.phone = enriched_data.get("phone") or company.phone
-            company.address = enriched_data.get("address") or company.address
-            company.website = enriched_data.get("website") or company.website
-            company.description = enriched_data.get("description") or company.description
-            
-            enriched_companies.append(company)
-            yield f"data: {json.dumps({'type': 'company', 'data': company.dict()})}\\n\\n"
-        
-        # Update global results
-        last_search_results = enriched_companies
+                # Stored as each company completes: the client's download links already point at this run
+                add_results(result_id, [company])
+                yield sse_event({'type': 'status', 'message': f'Enriched {len(enriched_companies)}/{len(unique_companies)}: {company.name}'})
+                
+                if not found:
+                    yield sse_event({'type': 'status', 'message': f'  No search results for {company.name}'})
+                    continue
+                
+                yield sse_event({'type': 'company', 'data': company.model_dump()})
+        finally:
+            # Client disconnected or generator closed early: stop outstanding searches and LLM calls
+            for task in tasks:
+                task.cancel()
         
-        yield f"data: {json.dumps({'type': 'done', 'message': f'Enrichment complete! {len(enriched_companies)} companies enriched'})}\\n\\n"
+        yield sse_event({'type': 'done', 'message': f'Enrichment complete! {len(enriched_companies)} companies enriched'})
     
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+    return StreamingResponse(with_keepalive(event_generator()), media_type="text/event-stream", headers=SSE_HEADERS)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import List, Optional
 
 class SearchRequest(BaseModel):
@@ -7,6 +7,9 @@ class SearchRequest(BaseModel):
     country: Optional[str] = None  # Optional country filter for more targeted searches
 
 class Company(BaseModel):
+    # Immutable once extracted; unknown keys sent back by the frontend are dropped
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     name: str
     website: Optional[str] = None
     description: Optional[str] = None
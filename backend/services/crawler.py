@@ -1,26 +1,101 @@
-import requests
+import logging
+import aiohttp
+import asyncio
+import hashlib
 import json
+import re
 import time
-from typing import List, Dict, Any, Optional
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple
 from models import Company
+from services.cache import TTLCache
+from services.http_session import get_session
+from services.process_pool import run_in_process
+
+logger = logging.getLogger(__name__)
+
+# Stream-parse Crawl4AI responses when ijson is available
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 CRAWL4AI_URL = "https://crawle.up.railway.app/crawl"
 
-def crawl_page_raw(url: str, js_code: List[str] = None) -> Dict[str, Any]:
+# Minimized Crawl4AI payloads keyed by (url, js_code) hash, kept for a day
+_CRAWL_CACHE = TTLCache(maxsize=256, ttl=86400)
+
+# Crawl4AI 5xx responses are usually transient; retry with exponential backoff
+_CRAWL_ATTEMPTS = 3
+_RETRY_STATUSES = (500, 502, 503, 504)
+
+def _crawl_cache_key(url: str, js_code: List[str]) -> str:
+    return hashlib.sha256((url + "|" + json.dumps(js_code)).encode()).hexdigest()
+
+# Enough markdown for the prefilter to pick BUDGET_CONTENT tokens (~4 chars/token) from
+_MAX_MARKDOWN_CHARS = 64_000
+# Pagination controls usually sit at the bottom of the page, so keep much more HTML
+_MAX_HTML_CHARS = 200_000
+
+def _minimize_result(result: Dict[str, Any]) -> Dict[str, str]:
     """
-    Helper to fetch raw content from Crawl4AI without LLM extraction.
-    Supports optional JS execution (e.g. for pagination).
+    Keeps only the fields the pipeline reads from a Crawl4AI result, length-capped.
+    Crawl4AI may return markdown either as a string or as {"raw_markdown": ...}.
+    Failed pages (success false, or neither markdown nor html) become {}.
     """
-    if js_code is None:
-        js_code = []
+    if result.get("success") is False:
+        return {}
+    markdown_data = result.get("markdown") or ""
+    if isinstance(markdown_data, dict):
+        markdown_data = markdown_data.get("raw_markdown") or ""
+    html = result.get("html") or ""
+    if not markdown_data and not html:
+        return {}
+    return {"markdown": markdown_data[:_MAX_MARKDOWN_CHARS], "html": html[:_MAX_HTML_CHARS]}
+
+async def parse_crawl_results(stream, count: int = 1) -> List[Tuple[Optional[str], Dict[str, str]]]:
+    """
+    Incrementally parses a Crawl4AI response body and returns up to `count` results
+    as (url, {"markdown", "html"}) pairs, with {} for pages Crawl4AI failed to fetch. The rest of the envelope (cleaned_html, links,
+    media, screenshots...) is never materialized, and reading stops once the last
+    wanted result has both fields; callers drain the rest to keep the connection reusable.
+    """
+    results: List[Dict[str, Any]] = []
+    async for prefix, event, value in ijson.parse_async(stream):
+        if prefix == "results.item" and event == "start_map":
+            if len(results) == count:
+                break
+            results.append({})
+            continue
+        if not results:
+            continue
+
+        current = results[-1]
+        if prefix == "results.item.success" and event == "boolean":
+            current.setdefault("success", value)
+            continue
+        if event != "string":
+            continue
+
+        if prefix == "results.item.url":
+            current.setdefault("url", value)
+        elif prefix in ("results.item.markdown", "results.item.markdown.raw_markdown"):
+            current.setdefault("markdown", value)
+        elif prefix == "results.item.html":
+            current.setdefault("html", value)
+        if len(results) == count and "markdown" in current and "html" in current:
+            break
+
+    # Failed pages are kept (as {}) so results still line up with the requested URLs
+    return [(r.get("url"), _minimize_result(r)) for r in results]
 
+def _build_payload(urls: List[str], js_code: List[str]) -> Dict[str, Any]:
     # Default scroll down script + any custom scripts
     combined_js = [
         "const scrollDown = async () => { window.scrollBy(0, window.innerHeight); }; scrollDown();"
     ] + js_code
 
-    payload = {
-        "urls": [url],
+    return {
+        "urls": urls,
         "priority": 20,
         "browser_type": "chromium",  # Explicitly use Puppeteer/Chromium
         "headless": True,
@@ -35,122 +110,249 @@ def crawl_page_raw(url: str, js_code: List[str] = None) -> Dict[str, Any]:
         "word_count_threshold": 1,
         "user_agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
     }
-    
+
+async def crawl_pages_raw(session: aiohttp.ClientSession, urls: List[str], js_code: List[str] = None) -> List[Dict[str, str]]:
+    """
+    Fetches several pages from Crawl4AI in a single request (cache misses only).
+    Returns one {"markdown": str, "html": str} per input URL, in order; {} for pages that failed.
+    """
+    if js_code is None:
+        js_code = []
+
+    pages: Dict[str, Dict[str, str]] = {}
+    for url in urls:
+        cached = _CRAWL_CACHE.get(_crawl_cache_key(url, js_code))
+        if cached is not None:
+            logger.debug("Crawl cache hit for %s", url)
+            pages[url] = cached
+
+    missing = [url for url in urls if url not in pages]
+    if not missing:
+        return [pages[url] for url in urls]
+
+    payload = _build_payload(missing, js_code)
+    # Crawl4AI renders batched URLs concurrently, allow some slack per extra page
+    timeout = aiohttp.ClientTimeout(total=90 + 30 * (len(missing) - 1))
+
     try:
-        response = requests.post(CRAWL4AI_URL, json=payload, timeout=60)
-        # response.raise_for_status() # Don't raise immediately, check status code manually
-        
-        if response.status_code == 200:
-            result = response.json()
-            if "results" in result and len(result["results"]) > 0:
-                # Return the full result object (with markdown and html)
-                return result["results"][0]
-        else:
-            print(f"Crawl failed for {url}: {response.status_code} - {response.text}")
-            
-        return {}
+        for attempt in range(_CRAWL_ATTEMPTS):
+            async with session.post(CRAWL4AI_URL, json=payload, timeout=timeout) as response:
+                # Don't raise immediately, check status code manually
+                if response.status == 200:
+                    if ijson:
+                        fetched = await parse_crawl_results(response.content, count=len(missing))
+                        # Discard the unread envelope tail without buffering it, so the
+                        # connection goes back to the pool instead of being closed
+                        async for _ in response.content.iter_any():
+                            pass
+                    else:
+                        result = await response.json(content_type=None)
+                        fetched = [(r.get("url"), _minimize_result(r)) for r in result.get("results", [])[:len(missing)]]
+
+                    # Match results back by URL, falling back to request order
+                    for position, (result_url, page_data) in enumerate(fetched):
+                        url = result_url if result_url in missing else missing[position]
+                        pages[url] = page_data
+                        # Failures (timeouts, blocks) are retried on the next search, not pinned for a day
+                        if page_data:
+                            _CRAWL_CACHE.set(_crawl_cache_key(url, js_code), page_data)
+                    break
+
+                if response.status in _RETRY_STATUSES and attempt < _CRAWL_ATTEMPTS - 1:
+                    # Transient Crawl4AI/gateway error: back off and retry without reading the body
+                    await asyncio.sleep(0.5 * 2 ** attempt)
+                    continue
+
+                # Only read the start of the error body, it can be a large HTML error page
+                error_body = (await response.content.read(512)).decode("utf-8", "replace")
+                logger.warning("Crawl failed for %s: %s - %s", ', '.join(missing), response.status, error_body)
+                break
     except Exception as e:
-        print(f"Crawl exception for {url}: {e}")
-        return {}
+        logger.warning("Crawl exception for %s: %s", ', '.join(missing), e)
 
-from services.llm_extractor import extract_data_with_llm
+    return [pages.get(url, {}) for url in urls]
 
-def process_url_flow(start_url: str, query: str) -> List[Company]:
+async def crawl_page_raw(session: aiohttp.ClientSession, url: str, js_code: List[str] = None) -> Dict[str, Any]:
+    """
+    Helper to fetch raw content from Crawl4AI without LLM extraction.
+    Supports optional JS execution (e.g. for pagination).
+    Returns {"markdown": str, "html": str}, or {} on failure. Successful fetches are cached.
+    """
+    return (await crawl_pages_raw(session, [url], js_code))[0]
+
+# Page number in query strings (?page=2, &p=2, ...) or paths (/page/2)
+_PAGE_NUMBER_RE = re.compile(r"([?&](?:page|p|pg|pageno|paged)=|/page/)(\d+)", re.IGNORECASE)
+
+def predict_page_urls(next_page_url: str, count: int) -> List[str]:
+    """
+    Given the URL of page N, guesses the URLs of pages N..N+count-1.
+    Returns [] if the URL has no recognizable page number.
+    """
+    matches = list(_PAGE_NUMBER_RE.finditer(next_page_url))
+    if not matches:
+        return []
+    match = matches[-1]
+    first = int(match.group(2))
+    return [
+        next_page_url[:match.start(2)] + str(first + offset) + next_page_url[match.end(2):]
+        for offset in range(count)
+    ]
+
+from services.llm_extractor import extract_data_with_llm_async, extract_interactive_elements, preprocess_page
+
+def _to_company(data: Dict[str, Any], page_url: str) -> Optional[Company]:
+    # Basic validation/cleanup
+    if not data.get("name"):
+        return None
+    return Company(
+        name=data.get("name", "Unknown"),
+        website=data.get("website"),
+        description=data.get("description"),
+        email=data.get("email"),
+        phone=data.get("phone"),
+        address=data.get("address"),
+        source_url=page_url
+    )
+
+def _company_emitter(page_url: str, on_company: Callable[[Company], None]) -> Callable[[Dict[str, Any]], None]:
+    """
+    Adapts `on_company` to the raw company dicts streamed by the LLM extractor.
+    """
+    def emit(data: Dict[str, Any]) -> None:
+        company = _to_company(data, page_url)
+        if company is not None:
+            on_company(company)
+    return emit
+
+async def _extract_page(
+    page_data: Dict[str, str],
+    page_url: str,
+    query: str,
+    on_company: Optional[Callable[[Company], None]] = None,
+) -> Tuple[List[Company], Dict[str, Any]]:
+    """
+    Runs LLM extraction on one fetched page.
+    Returns the companies found and the raw extraction result (for pagination hints).
+    If given, `on_company` receives each company while the LLM response is still streaming.
+    """
+    html_content = page_data.get("html", "")
+
+    # Prefer Markdown for LLM extraction to save tokens and reduce noise
+    # If markdown is empty/fail, fallback to the cleaned HTML
+    content_to_analyze = page_data.get("markdown", "")
+
+    if not content_to_analyze or len(content_to_analyze) < 100:
+        # Fallback to HTML: one parse gives both the boilerplate-free HTML and the interactive elements
+        content_to_analyze, interactive_html = await run_in_process(preprocess_page, html_content)
+    else:
+        # Only pagination candidates are needed, stream them without building the DOM
+        interactive_html = await run_in_process(extract_interactive_elements, html_content)
+        
+    logger.debug("Analyzing content length: %s", len(content_to_analyze))
+
+    streamed = _company_emitter(page_url, on_company) if on_company is not None else None
+    
+    # LLM Extraction
+    # Pass Markdown for content, interactive HTML for pagination
+    extraction_result = await extract_data_with_llm_async(content_to_analyze, interactive_html, query, streamed)
+    
+    new_companies_data = extraction_result.get("companies", [])
+    logger.debug("EXTRACTOR: Found %s companies on %s.", len(new_companies_data), page_url)
+
+    companies = [c for c in (_to_company(data, page_url) for data in new_companies_data) if c is not None]
+    return companies, extraction_result
+
+async def process_url_flow(
+    start_url: str,
+    query: str,
+    on_company: Optional[Callable[[Company], None]] = None,
+    visited_urls: Optional[Set[str]] = None,
+) -> List[Company]:
     """
     Orchestrates the crawl flow for a single URL using LLM Extraction & Pagination:
     1. Fetch Raw Content (Page 1)
     2. Extract Data & Next Page using LLM
     3. Loop until no next page or limit reached (3 pages)
+    
+    When the next page is a URL with a page number, the remaining pages are
+    predicted, fetched in one Crawl4AI request and extracted in parallel.
+    `on_company` (optional) is called with each company as soon as the LLM produces it;
+    the full list is still returned at the end.
+    `visited_urls` (optional) is shared by concurrent flows of one search, so a page reached
+    from several start URLs (e.g. page 2 of the same directory) is crawled only once.
     """
+    session = get_session()
     companies: List[Company] = []
     current_url = start_url
     pages_crawled = 0
-    visited_urls = set()
+    max_pages = 3
+    if visited_urls is None:
+        visited_urls = set()
     
     # Store JS instructions for the NEXT page load
     next_page_js_code = []
 
-    print(f"Processing URL: {start_url}")
+    logger.debug("Processing URL: %s", start_url)
 
-    while current_url and pages_crawled < 3:
+    while current_url and pages_crawled < max_pages:
         # If we are visiting via a normal URL change, check visited.
         # If we are "clicking" (JS) on the same URL, we might technically be on the same URL string 
         # but displaying different content. So visited checks might need to be relaxed if using JS.
         # Strategy: Trust the loop limit.
         
         if not next_page_js_code and current_url in visited_urls:
-            print(f"Already visited {current_url} (and no JS action), stopping loop.")
+            logger.debug("Already visited %s (and no JS action), stopping loop.", current_url)
             break
         visited_urls.add(current_url)
 
         if pages_crawled > 0:
-             print(f"Crawling page {pages_crawled + 1}: {current_url}")
+             logger.debug("Crawling page %s: %s", pages_crawled + 1, current_url)
         
         # Execute crawl with any pending JS (e.g. click next)
-        page_data = crawl_page_raw(current_url, js_code=next_page_js_code)
+        page_data = await crawl_page_raw(session, current_url, js_code=next_page_js_code)
         
         # Reset JS code after use
         next_page_js_code = []
         
         if not page_data:
-            print(f"Failed to fetch content for {current_url}")
+            logger.warning("Failed to fetch content for %s", current_url)
             break
-            
-        # Prefer Markdown for LLM extraction to save tokens and reduce noise
-        # If markdown is empty/fail, fallback to HTML
-        content_to_analyze = ""
-        markdown_data = page_data.get("markdown", "")
-        if isinstance(markdown_data, dict):
-            content_to_analyze = markdown_data.get("raw_markdown", "")
-        elif isinstance(markdown_data, str):
-            content_to_analyze = markdown_data
-            
-        if not content_to_analyze or len(content_to_analyze) < 100:
-            # Fallback to HTML
-            content_to_analyze = page_data.get("html", "")
-            
-        print(f"Analyzing content length: {len(content_to_analyze)}")
-        
-        # LLM Extraction
-        # Pass Markdown for content, HTML for pagination
-        html_content = page_data.get("html", "")
-        extraction_result = extract_data_with_llm(content_to_analyze, html_content, query)
-        
-        new_companies_data = extraction_result.get("companies", [])
+
+        page_companies, extraction_result = await _extract_page(page_data, current_url, query, on_company)
+        companies.extend(page_companies)
+        pages_crawled += 1
         
         # Check for Pagination Methods
         next_page_url = extraction_result.get("next_page_url")
         pagination_selector = extraction_result.get("pagination_selector")
         
-        print(f"EXTRACTOR: Found {len(new_companies_data)} companies.")
-        print(f"   Next URL: {next_page_url}")
-        print(f"   Pagination Selector: {pagination_selector}")
-        
-        for c in new_companies_data:
-            # Basic validation/cleanup
-            if c.get("name"):
-                 companies.append(Company(
-                    name=c.get("name", "Unknown"),
-                    website=c.get("website"),
-                    description=c.get("description"),
-                    email=c.get("email"),
-                    phone=c.get("phone"),
-                    address=c.get("address"),
-                    source_url=current_url
-                ))
+        logger.debug("Next URL: %s, pagination selector: %s", next_page_url, pagination_selector)
         
         # Pagination Logic Priority
         # 1. URL change is most reliable
         if next_page_url and next_page_url != current_url and next_page_url.startswith("http"):
-             current_url = next_page_url
-             next_page_js_code = [] # Reset JS
+            remaining = max_pages - pages_crawled
+            predicted = [u for u in predict_page_urls(next_page_url, remaining) if u not in visited_urls]
+            if len(predicted) > 1:
+                # Numbered pages: fetch them all in one request, extract in parallel
+                logger.debug("Batch crawling predicted pages: %s", predicted)
+                visited_urls.update(predicted)
+                pages = await crawl_pages_raw(session, predicted)
+                fetched = [(url, data) for url, data in zip(predicted, pages) if data]
+                results = await asyncio.gather(*(_extract_page(data, url, query, on_company) for url, data in fetched))
+                for page_companies, _ in results:
+                    companies.extend(page_companies)
+                break
+
+            current_url = next_page_url
+            next_page_js_code = [] # Reset JS
              
         # 2. JS Click if no URL change (or explicit selector found)
         elif pagination_selector:
             # We are staying on 'current_url' (or at least starting from it) but executing a click
             # IMPORTANT: We stick to current_url, but next iteration we pass JS.
             # Only do this if we haven't hit limit.
-            print(f"Preparing to click selector: {pagination_selector}")
+            logger.debug("Preparing to click selector: %s", pagination_selector)
             next_page_js_code = [
                 f"const el = document.querySelector('{pagination_selector}'); if(el) {{ el.click(); }} else {{ console.log('Selector not found'); }}",
                 "new Promise(r => setTimeout(r, 3000));" # Wait for update
@@ -160,6 +362,4 @@ def process_url_flow(start_url: str, query: str) -> List[Company]:
         else:
             current_url = None # Stop loop
             
-        pages_crawled += 1
-            
     return companies
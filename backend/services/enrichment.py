@@ -1,96 +1,168 @@
-import os
-from typing import List, Dict, Any
+import asyncio
+import logging
+from contextlib import nullcontext
+from typing import List, Dict, Any, Optional, Tuple
 from models import Company
 from services.searxng import search_google
-from openai import OpenAI
-import json
+from services.llm_cache import cache_key, get_cached, store
+from services.openai_client import create_chat_completion, get_async_client
+import orjson
+
+logger = logging.getLogger(__name__)
+
+# Same prefix on every call, so OpenAI can serve it from its prompt cache
+SYSTEM_PROMPT_ENRICH = """You are a data enrichment assistant.
+Your task is to extract and consolidate contact information for a company from search result snippets.
+
+Extract the following if available:
+- email: company email address
+- phone: company phone number
+- address: physical address
+- website: official website URL
+- description: brief company description (2-3 sentences max)
+
+If a field is not found, use null. Prioritize official/primary contact details.
+The user message gives the company name and the search result snippets to extract from.
+"""
+
+# Structured-output schema for enrichment (strict mode: every field required, null when not found)
+_NULLABLE_STRING = {"type": ["string", "null"]}
+ENRICH_FIELDS = ("email", "phone", "address", "website", "description")
+ENRICH_SCHEMA = {
+    "type": "object",
+    "properties": {field: _NULLABLE_STRING for field in ENRICH_FIELDS},
+    "required": list(ENRICH_FIELDS),
+    "additionalProperties": False,
+}
+
+def normalize_name(name: str) -> str:
+    """
+    Normalized company name used as the deduplication key.
+    """
+    return name.casefold().strip()
+
+def index_by_name(companies: List[Company]) -> Dict[str, Company]:
+    """
+    Maps each normalized name to its first occurrence, in input order.
+    Lets callers merge enriched results back by name without re-scanning the list.
+    """
+    index: Dict[str, Company] = {}
+    for company in companies:
+        key = normalize_name(company.name)
+        if key and key not in index:
+            index[key] = company
+    return index
 
 def deduplicate_by_name(companies: List[Company]) -> List[Company]:
     """
     Deduplicate companies by name (case-insensitive).
     Keeps the first occurrence of each unique name.
     """
-    seen_names = set()
-    unique_companies = []
+    unique_companies = list(index_by_name(companies).values())
     
-    for company in companies:
-        name_lower = company.name.lower().strip()
-        if name_lower and name_lower not in seen_names:
-            seen_names.add(name_lower)
-            unique_companies.append(company)
-    
-    print(f"Deduplication: {len(companies)} -> {len(unique_companies)} unique companies")
+    logger.debug("Deduplication: %s -> %s unique companies", len(companies), len(unique_companies))
     return unique_companies
 
-def enrich_company_details(company_name: str, search_snippets: List[str]) -> Dict[str, Any]:
+async def enrich_company_details(company_name: str, search_snippets: List[str]) -> Dict[str, Any]:
     """
     Use LLM to extract and enrich contact details from search result snippets.
     Returns dict with enriched fields: email, phone, address, website, description
     """
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        print(f"Warning: No OpenAI API Key. Skipping enrichment for {company_name}")
+    client = get_async_client()
+    if client is None:
+        logger.warning("No OpenAI API Key. Skipping enrichment for %s", company_name)
         return {}
     
-    client = OpenAI(api_key=api_key)
-    
     # Combine snippets into context
     context = "\n\n".join(search_snippets[:20])  # Limit to avoid token overflow
     
-    system_prompt = """You are a data enrichment assistant. 
-    Your task is to extract and consolidate contact information for a company from search result snippets.
-    
-    Extract the following if available:
-    - email: company email address
-    - phone: company phone number
-    - address: physical address
-    - website: official website URL
-    - description: brief company description (2-3 sentences max)
-    
-    Return JSON:
-    {
-        "email": "...",
-        "phone": "...",
-        "address": "...",
-        "website": "...",
-        "description": "..."
-    }
-    
-    If a field is not found, use null. Prioritize official/primary contact details.
-    """
-    
     user_prompt = f"""Company Name: {company_name}
 
 Search Results Context:
-{context[:10000]}
-
-Extract and return the contact details in JSON format."""
+{context[:10000]}"""
     
+    model = "gpt-4o-mini"
+    messages = [
+        {"role": "system", "content": SYSTEM_PROMPT_ENRICH},
+        {"role": "user", "content": user_prompt}
+    ]
+
+    # temperature=0 makes the response a pure function of (model, messages)
+    key = cache_key(model, messages)
+    cached = get_cached(key)
+    if cached is not None:
+        return cached
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+        response = await create_chat_completion(
+            client,
+            model=model,
+            messages=messages,
             temperature=0.0,
-            response_format={"type": "json_object"}
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "enrichment", "schema": ENRICH_SCHEMA, "strict": True}
+            }
         )
         
-        enriched_data = json.loads(response.choices[0].message.content)
+        enriched_data = orjson.loads(response.choices[0].message.content)
+        store(key, enriched_data)
         return enriched_data
         
     except Exception as e:
-        print(f"LLM Enrichment Error for {company_name}: {e}")
+        logger.warning("LLM Enrichment Error for %s: %s", company_name, e)
         return {}
 
-def enrich_companies(companies: List[Company], country: str = None) -> List[Company]:
+async def enrich_company(
+    company: Company,
+    country: str = None,
+    search_limit: Optional[asyncio.Semaphore] = None,
+    llm_limit: Optional[asyncio.Semaphore] = None,
+) -> Tuple[Company, bool]:
+    """
+    Searches for one company's contact info (40 results) and merges LLM-enriched fields into it.
+    Returns (company, found) where found is False if the search returned no snippets.
+    The optional semaphores bound the search and LLM steps independently, so a batch
+    can run all its searches up front and start LLM calls as search results arrive.
+    """
+    # Search for company contact info (including country if provided)
+    if country:
+        search_query = f"{company.name} {country} contact information"
+    else:
+        search_query = f"{company.name} contact information"
+    async with search_limit or nullcontext():
+        search_results = await search_google(search_query, 40)
+    snippets = [result.get("content", "") for result in search_results if result.get("content")]
+
+    if not snippets:
+        return company, False
+
+    # LLM enrichment
+    async with llm_limit or nullcontext():
+        enriched_data = await enrich_company_details(company.name, snippets)
+
+    # Merge enriched data with existing company data (prefer new data if not empty)
+    # Company is frozen, so build an updated copy
+    enriched = company.model_copy(update={
+        "email": enriched_data.get("email") or company.email,
+        "phone": enriched_data.get("phone") or company.phone,
+        "address": enriched_data.get("address") or company.address,
+        "website": enriched_data.get("website") or company.website,
+        "description": enriched_data.get("description") or company.description,
+    })
+
+    return enriched, True
+
+async def enrich_companies(companies: List[Company], country: str = None, concurrency: int = 10, search_concurrency: int = 12) -> List[Company]:
     """
     Main enrichment pipeline:
     1. Deduplicate by name
     2. For each unique company, search for additional info (40 results)
     3. Use LLM to enrich contact details
     
+    Searches run concurrently (at most `search_concurrency` at a time) and each
+    company's LLM step starts as soon as its search completes (at most `concurrency` at a time).
+    
     Args:
         companies: List of Company objects to enrich
         country: Optional country name to include in search query for more targeted results
@@ -99,34 +171,14 @@ def enrich_companies(companies: List[Company], country: str = None) -> List[Comp
     unique_companies = deduplicate_by_name(companies)
     
     # Step 2 & 3: Enrich each company
-    enriched_companies = []
-    
-    for idx, company in enumerate(unique_companies):
-        print(f"Enriching {idx+1}/{len(unique_companies)}: {company.name}")
-        
-        # Search for company contact info (including country if provided)
-        if country:
-            search_query = f"{company.name} {country} contact information"
-        else:
-            search_query = f"{company.name} contact information"
-        search_results = search_google(search_query, limit=20)
-        snippets = [result.get("content", "") for result in search_results if result.get("content")]
-        
-        if not snippets:
-            print(f"  No search results found for {company.name}")
-            enriched_companies.append(company)
-            continue
-        
-        # LLM enrichment
-        enriched_data = enrich_company_details(company.name, snippets)
-        
-        # Merge enriched data with existing company data (prefer new data if not empty)
-        company.email = enriched_data.get("email") or company.email
-        company.phone = enriched_data.get("phone") or company.phone
-        company.address = enriched_data.get("address") or company.address
-        company.website = enriched_data.get("website") or company.website
-        company.description = enriched_data.get("description") or company.description
-        
-        enriched_companies.append(company)
-    
-    return enriched_companies
+    search_limit = asyncio.Semaphore(search_concurrency)
+    llm_limit = asyncio.Semaphore(concurrency)
+
+    async def enrich_one(company: Company) -> Company:
+        logger.debug("Enriching: %s", company.name)
+        enriched, found = await enrich_company(company, country, search_limit, llm_limit)
+        if not found:
+            logger.debug("No search results found for %s", company.name)
+        return enriched
+
+    return list(await asyncio.gather(*(enrich_one(c) for c in unique_companies)))
@@ -0,0 +1,28 @@
+import aiohttp
+from typing import Optional
+
+# Shared connection pool for all outbound HTTP (Crawl4AI, SearxNG).
+# Created lazily because aiohttp sessions must be bound to the running event loop.
+_session: Optional[aiohttp.ClientSession] = None
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the process-wide aiohttp session, creating it on first use.
+    Must be called from within the running event loop.
+    """
+    global _session
+    if _session is None or _session.closed:
+        # Keep idle sockets around long enough to survive an LLM extraction between page fetches
+        # (aiohttp's default is 15s), so follow-up pages reuse the warm TLS connection.
+        connector = aiohttp.TCPConnector(limit=200, limit_per_host=20, ttl_dns_cache=300, keepalive_timeout=75)
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+async def close_session() -> None:
+    """
+    Closes the shared session (called on app shutdown).
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
@@ -0,0 +1,20 @@
+import hashlib
+import orjson
+from typing import Any, Dict, List, Optional
+from services.cache import TTLCache
+
+# Parsed JSON responses of deterministic (temperature=0) chat completions, kept for a day
+_LLM_CACHE = TTLCache(maxsize=2048, ttl=86400)
+
+def cache_key(model: str, messages: List[Dict[str, str]]) -> str:
+    """
+    Exact-match key for a chat completion request.
+    """
+    payload = orjson.dumps({"model": model, "messages": messages}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+def get_cached(key: str) -> Optional[Dict[str, Any]]:
+    return _LLM_CACHE.get(key)
+
+def store(key: str, value: Dict[str, Any]) -> None:
+    _LLM_CACHE.set(key, value)
@@ -1,205 +1,453 @@
-from openai import OpenAI
+import asyncio
+import logging
+import hashlib
+import io
 import os
-import json
-from typing import List, Dict, Any, Optional
+import orjson
+from typing import Callable, List, Dict, Any, Optional, Tuple
+from services.cache import TTLCache
+from services.openai_client import create_chat_completion, get_async_client, get_client, stream_chat_completion
+from services.prefilter import BUDGET_PAGINATION, select_relevant_text, truncate_to_tokens
 
-# Try to import BeautifulSoup for cleaning
+__all__ = [
+    "EXTRACT_MODEL",
+    "EXTRACT_SCHEMA",
+    "SYSTEM_PROMPT_EXTRACT",
+    "USE_BATCH_API",
+    "preprocess_page",
+    "clean_content",
+    "extract_interactive_elements",
+    "build_extraction_messages",
+    "extract_data_with_llm",
+    "extract_data_with_llm_async",
+    "submit_extraction_batch",
+    "collect_extraction_batch",
+]
+
+# Prefer selectolax (C-backed lexbor parser) for page preprocessing, lxml is the fallback.
+# selectolax 1.0 removed the Modest backend (selectolax.parser), older releases only have that one.
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+import lxml.etree
+import lxml.html
+
+# Incremental JSON parsing of streamed completions; without it companies are handed over at the end
 try:
-    from bs4 import BeautifulSoup
+    import ijson
 except ImportError:
-    BeautifulSoup = None
+    ijson = None
+
+logger = logging.getLogger(__name__)
+
+# Elements and attributes surfaced to the LLM for pagination detection
+_INTERACT_TAGS = ("a", "button", "input")
+_INTERACT_SELECTOR = ",".join(_INTERACT_TAGS)
+_INTERACT_XPATH = lxml.etree.XPath("//a|//button|//input")
+_INTERACT_ATTRS = frozenset(("id", "class", "aria-label", "title", "name", "value", "type"))
+_LINK_ATTRS = _INTERACT_ATTRS | {"href"}
+# Keeps attribute values from closing the quoted attribute early
+_ATTR_ESCAPE = str.maketrans({'"': "&quot;"})
+
+# Boilerplate removed from the cleaned HTML
+_BOILERPLATE_TAGS = ("script", "style", "nav", "header", "footer", "iframe", "svg", "noscript", "meta")
+
+_MAX_PARSE_CHARS = 200_000  # raw HTML is cut before parsing; pagination sits near the end of most listings
+_MAX_INTERACTIVE_ELEMENTS = 500
+
+def _format_interactive(tag_name: str, attributes, text: str) -> str:
+    """
+    Renders one interactive element as a compact tag string for the LLM.
+    `attributes` is the element's attribute mapping; only the key attributes are kept.
+    """
+    keep = _LINK_ATTRS if tag_name == "a" else _INTERACT_ATTRS
+    attr_str = " ".join(
+        f'{attr}="{val.translate(_ATTR_ESCAPE)}"' for attr, val in attributes.items() if val and attr in keep
+    )
+    return f'<{tag_name} {attr_str}>{text[:50]}</{tag_name}>' # Limit text length
+
+def _element_text(el) -> str:
+    # Full text content: numbered pagination links often wrap their label in a <span>
+    return "".join(el.itertext()).strip()
+
+def preprocess_page(html_content: str) -> Tuple[str, str]:
+    """
+    Parses the page once and returns (cleaned_html, interactive_html):
+    - cleaned_html: body HTML without boilerplate (nav, header, footer, scripts); the extractor
+      fits it to the token budget with select_relevant_text
+    - interactive_html: a, button and input elements with their attributes, to help the LLM find pagination
+    Interactive elements are collected before stripping since pagination often lives in nav/footer.
+    """
+    if not html_content:
+        return "", ""
+    html_content = html_content[:_MAX_PARSE_CHARS]
+
+    if HTMLParser:
+        tree = HTMLParser(html_content)
+        elements = [
+            _format_interactive(node.tag, node.attributes, node.text(strip=True))
+            for node in tree.css(_INTERACT_SELECTOR)[:_MAX_INTERACTIVE_ELEMENTS]
+        ]
+        # One C-level pass removes every boilerplate element with its subtree
+        tree.strip_tags(list(_BOILERPLATE_TAGS))
+        root = tree.body or tree.root
+        cleaned = (root.html or "") if root else ""
+        return cleaned, "\n".join(elements)
+
+    try:
+        tree = lxml.html.fromstring(html_content)
+    except (lxml.etree.ParserError, ValueError):
+        return html_content, ""
+
+    elements = [
+        _format_interactive(el.tag, el.attrib, _element_text(el))
+        for el in _INTERACT_XPATH(tree)[:_MAX_INTERACTIVE_ELEMENTS]
+    ]
+    lxml.etree.strip_elements(tree, *_BOILERPLATE_TAGS, with_tail=False)
+    body = tree.find(".//body")
+    cleaned = lxml.html.tostring(body if body is not None else tree, encoding="unicode")
+    return cleaned, "\n".join(elements)
 
 def clean_content(html_content: str) -> str:
     """
     Cleans HTML content by removing boilerplate tags (nav, header, footer, scripts).
-    Returns text content.
+    Returns the cleaned body HTML.
     """
-    if not BeautifulSoup:
-        return html_content # Fallback
-
-    soup = BeautifulSoup(html_content, "lxml")
-    
-    # Remove distracting elements
-    for tag in soup(["script", "style", "nav", "header", "footer", "iframe", "svg", "noscript", "meta"]):
-        tag.decompose()
-        
-    # Get text, or return cleaned HTML if we want structure? 
-    # LLMs handle HTML structure well for tables. Let's return cleaned HTML string mainly for structure.
-    # But to save tokens, let's try to get a structured text representation or just the body.
-    
-    body = soup.find("body")
-    if body:
-        return str(body)[:15000] # Limit to ~15k chars to avoid token limits (approx 3-4k tokens)
-    
-    return str(soup)[:15000]
+    return preprocess_page(html_content)[0]
 
 def extract_interactive_elements(html_content: str) -> str:
     """
     Extracts interactive elements (a, button, input) with their attributes to help LLM find pagination.
+    Streams the document with lxml's iterparse instead of building a full tree, freeing each
+    element once formatted and stopping at the 500-element cap. Use preprocess_page when the
+    cleaned HTML is needed as well.
     """
-    if not BeautifulSoup or not html_content:
+    if not html_content:
         return ""
-        
-    soup = BeautifulSoup(html_content, "lxml")
+
     elements = []
-    
-    # Find all potentially interactive elements
-    for tag in soup.find_all(["a", "button", "input"]):
-        # Get key attributes
-        attrs = []
-        if tag.name == "a" and tag.get("href"):
-            attrs.append(f'href="{tag.get("href")}"')
-        
-        for attr in ["id", "class", "aria-label", "title", "name", "value", "type"]:
-             val = tag.get(attr)
-             if val:
-                 if isinstance(val, list): val = " ".join(val)
-                 attrs.append(f'{attr}="{val}"')
-        
-        text = tag.get_text(strip=True)[:50] # Limit text length
-        attr_str = " ".join(attrs)
-        
-        elements.append(f'<{tag.name} {attr_str}>{text}</{tag.name}>')
-        
-    return "\n".join(elements[:500]) # Limit to first 500 elements or so to save context
+    source = io.BytesIO(html_content[:_MAX_PARSE_CHARS].encode())
+    try:
+        for _, el in lxml.etree.iterparse(source, events=("end",), tag=_INTERACT_TAGS, html=True, encoding="utf-8"):
+            # Children are still attached at the "end" event, so nested labels are included
+            elements.append(_format_interactive(el.tag, el.attrib, _element_text(el)))
+            if len(elements) >= _MAX_INTERACTIVE_ELEMENTS:
+                break
+            # Drop the element and already-seen siblings so memory stays flat on huge pages
+            el.clear(keep_tail=True)
+            parent = el.getparent()
+            if parent is not None:
+                while el.getprevious() is not None:
+                    del parent[0]
+    except lxml.etree.XMLSyntaxError:
+        pass
+    return "\n".join(elements)
 
-def extract_data_with_llm(content_markdown: str, html_content: str, query: str) -> Dict[str, Any]:
-    """
-    Extracts company data and next page URL/Selector using LLM.
-    Uses Markdown for content and HTML snippets for pagination.
-    """
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        print("Warning: No OpenAI API Key. Returning empty extraction.")
-        return {"companies": [], "next_page_url": None, "pagination_selector": None}
+# Structured-output schema for extraction (strict mode requires every property to be listed as required)
+_NULLABLE_STRING = {"type": ["string", "null"]}
+EXTRACT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "companies": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "website": _NULLABLE_STRING,
+                    "email": _NULLABLE_STRING,
+                    "phone": _NULLABLE_STRING,
+                    "address": _NULLABLE_STRING,
+                    "description": _NULLABLE_STRING,
+                },
+                "required": ["name", "website", "email", "phone", "address", "description"],
+                "additionalProperties": False,
+            },
+        },
+        "next_page_url": _NULLABLE_STRING,
+        "pagination_selector": _NULLABLE_STRING,
+    },
+    "required": ["companies", "next_page_url", "pagination_selector"],
+    "additionalProperties": False,
+}
 
-    client = OpenAI(api_key=api_key)
-    
-    # 1. Prepare Content (Markdown for Companies)
-    # 2. Prepare Interactive Elements (HTML for Pagination)
-    interactive_html = extract_interactive_elements(html_content)
-    
-    system_prompt = """You are a data extraction bot. Your job is to find and extract INDIVIDUAL COMPANIES from the webpage content.
-
-IMPORTANT: You are looking for COMPANIES LISTED ON THE PAGE, sometimes the website itself is not a company.
-
-STEP 1: Read the content carefully
-- Look for company names, business names, supplier names, manufacturer names
-- These can appear in: lists, tables, cards, repeated sections, or profile blocks
-- Look for PATTERNS - if you see similar information repeated, those are likely individual companies
-- Each company is a SEPARATE entry
-
-STEP 2: Extract EACH company you find
-For each company, extract:
-- name: The company/business name
-- website: Their website URL (if mentioned)
-- email: Their email (if mentioned)  
-- phone: Their phone (if mentioned)
-- address: Their address/location (if mentioned)
-- description: What they do/sell (if mentioned)
-
-STEP 3: What NOT to extract
-
-DO NOT extract if the text is:
-- A question or request (e.g., "I need suppliers", "Looking for...", "Anyone selling...")
-- An error message (e.g., "Cloudflare", "404", "Access Denied")
-- A page section (e.g., "About Us", "Contact Us", "Home")
-- The website's own name (we want companies LISTED on the page, not the page itself)
-
-EXAMPLES:
-
-Example 1 - Directory Page:
-Content: "1. ABC Cosmetics - Kathmandu - abc@mail.com - Makeup products
-          2. XYZ Beauty Ltd - Pokhara - xyz@mail.com - Skincare"
-
-Extract:
-[
-  {"name": "ABC Cosmetics", "address": "Kathmandu", "email": "abc@mail.com", "description": "Makeup products"},
-  {"name": "XYZ Beauty Ltd", "address": "Pokhara", "email": "xyz@mail.com", "description": "Skincare"}
-]
+EXTRACT_MODEL = "gpt-4o-mini"
+_EXTRACT_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "extraction", "schema": EXTRACT_SCHEMA, "strict": True}
+}
+_EMPTY_EXTRACTION = {"companies": [], "next_page_url": None, "pagination_selector": None}
 
-Example 2 - Table:
-Content: "| Company | City | Contact |
-          | Nepal Beauty Co | Kathmandu | contact@nepal.com |
-          | Himalaya Cosmetics | Lalitpur | info@himalaya.np |"
+# Extraction results keyed by page content, so re-crawled or duplicate pages skip prompt building
+# and the LLM call entirely; kept for a week
+_EXTRACTION_CACHE = TTLCache(maxsize=1024, ttl=7 * 86400)
 
-Extract:
-[
-  {"name": "Nepal Beauty Co", "address": "Kathmandu", "email": "contact@nepal.com"},
-  {"name": "Himalaya Cosmetics", "address": "Lalitpur", "email": "info@himalaya.np"}
-]
+def _extraction_key(content_markdown: str, interactive_html: str, query: str) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    for part in (EXTRACT_MODEL, query, content_markdown, interactive_html):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
 
-Example 3 - Search Results / Card Layout:
-Content: "Company: ABC Corp
-          Location: Kuala Lumpur, Malaysia
-          
-          Company: XYZ Industries  
-          Location: Penang, Malaysia
-          
-          Company: PQR Trading
-          Location: Johor, Malaysia"
-
-Extract:
-[
-  {"name": "ABC Corp", "address": "Kuala Lumpur, Malaysia"},
-  {"name": "XYZ Industries", "address": "Penang, Malaysia"},
-  {"name": "PQR Trading", "address": "Johor, Malaysia"}
-]
+# Offline crawl jobs may submit pages through the OpenAI Batch API (half price, separate rate limits)
+USE_BATCH_API = os.environ.get("USE_BATCH_API", "").lower() in ("1", "true", "yes")
 
-Example 4 - Buyer Request (DO NOT EXTRACT):
-Content: "I want cosmetics suppliers in Nepal. Anyone can help?"
+# Static instructions kept byte-identical across calls so OpenAI can cache the prompt prefix;
+# everything page-specific goes in the user message
+SYSTEM_PROMPT_EXTRACT = """You extract the INDIVIDUAL COMPANIES listed on a webpage (the website itself is usually not one of them).
 
-Extract: []
+Output (enforced by the response schema):
+```
+{"companies": [{"name", "website", "email", "phone", "address", "description"}], "next_page_url", "pagination_selector"}
+```
 
-Example 5 - Error Page (DO NOT EXTRACT):
-Content: "Cloudflare - Access Denied"
+Rules:
+- Companies appear as list items, table rows, cards or profile blocks; repeated patterns mean one company per repeat.
+- name is required; every other field is the value stated on the page, or null.
+- description: what the company does or sells, in one short sentence.
+- Skip questions/requests ("Looking for suppliers..."), error pages ("Cloudflare", "404", "Access Denied"),
+  page sections ("About Us", "Contact Us", "Home") and the website's own name.
+- Never invent data that is not on the page.
+- next_page_url: link to the next page of results ("Next", "Load More", page 2, 3...), else null.
+- pagination_selector: CSS selector for a next/load-more button when there is no link, else null.
 
-Extract: []
+The user message holds the query, the page content (extract ALL companies from it) and the
+page's interactive elements (use them for pagination).
 
-PAGINATION: Also look for "Next", "Load More", or page 2, 3, etc. buttons to help us get more companies.
+Example: "1. ABC Cosmetics - Kathmandu - abc@mail.com" ->
+{"name": "ABC Cosmetics", "website": null, "email": "abc@mail.com", "phone": null, "address": "Kathmandu", "description": null}
+"""
 
-Return JSON:
-{
-  "companies": [...],
-  "next_page_url": "URL if you find a next page link",
-  "pagination_selector": "CSS selector for next button"
-}
+def build_extraction_messages(content_markdown: str, interactive_html: str, query: str) -> List[Dict[str, str]]:
+    """
+    Builds the chat messages for extracting companies and pagination from one page.
+    Uses Markdown for content and interactive HTML snippets (see preprocess_page) for pagination.
+    """
+    # Keep only the blocks most likely to list companies, within the token budget
+    content_for_llm = select_relevant_text(content_markdown)
 
-REMEMBER: Extract INDIVIDUAL COMPANIES from the content, not the website itself.
-"""
-    
-    # Debug: Print first 500 chars of content to see what LLM is receiving
-    print(f"\n=== LLM EXTRACTOR DEBUG ===")
-    print(f"Query: {query}")
-    print(f"Content length: {len(content_markdown)} chars")
-    print(f"Content preview (first 500 chars):\n{content_markdown[:500]}")
-    print(f"===========================\n")
-    
-    user_prompt = f"""User Query: {query}
-    
-    --- WEBPAGE CONTENT (Extract companies from this) ---
-    {content_markdown[:15000]}
-    
-    --- INTERACTIVE ELEMENTS (For pagination) ---
-    {interactive_html[:10000]}
+    # Debug: first 500 chars of content to see what LLM is receiving
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Extracting for query %r: %s chars (%s after prefilter), preview:\n%s",
+            query, len(content_markdown), len(content_for_llm), content_markdown[:500]
+        )
     
-    EXTRACT ALL COMPANIES YOU FIND. Look for repeated patterns of business names with location/contact info.
+    # Only request-specific data here; the instructions live in the cached system prefix
+    user_prompt = (
+        f"USER QUERY: {query}\n\n"
+        f"--- WEBPAGE CONTENT (Extract companies from this) ---\n{content_for_llm}\n\n"
+        f"--- INTERACTIVE ELEMENTS (For pagination) ---\n{truncate_to_tokens(interactive_html, BUDGET_PAGINATION)}"
+    )
+
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT_EXTRACT},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def extract_data_with_llm(content_markdown: str, interactive_html: str, query: str) -> Dict[str, Any]:
+    """
+    Extracts company data and next page URL/Selector using LLM.
+    Uses Markdown for content and the interactive HTML from preprocess_page for pagination.
     """
+    client = get_client()
+    if client is None:
+        logger.warning("No OpenAI API Key. Returning empty extraction.")
+        return dict(_EMPTY_EXTRACTION)
+
+    # temperature=0 makes the response a pure function of the page, query and model
+    key = _extraction_key(content_markdown, interactive_html, query)
+    cached = _EXTRACTION_CACHE.get(key)
+    if cached is not None:
+        return cached
+
+    model = EXTRACT_MODEL
+    messages = build_extraction_messages(content_markdown, interactive_html, query)
 
     try:
         response = client.chat.completions.create(
-            model="gpt-3.5-turbo-16k", 
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+            model=model,
+            messages=messages,
             temperature=0.0,
-            response_format={"type": "json_object"}
+            response_format=_EXTRACT_RESPONSE_FORMAT
         )
         
-        result = json.loads(response.choices[0].message.content)
+        result = orjson.loads(response.choices[0].message.content)
+        _EXTRACTION_CACHE.set(key, result)
         return result
         
     except Exception as e:
-        print(f"LLM Extraction Error: {e}")
-        return {"companies": [], "next_page_url": None, "pagination_selector": None}
+        logger.warning("LLM Extraction Error: %s", e)
+        return dict(_EMPTY_EXTRACTION)
+
+async def _stream_extraction(client, messages: List[Dict[str, str]], on_company: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """
+    Streams the completion and hands each company to `on_company` as soon as its JSON object
+    is complete. Returns the full parsed result once the stream ends.
+    """
+    chunks: List[str] = []
+    items = parser = None
+    if ijson is not None:
+        items = ijson.sendable_list()
+        parser = ijson.items_coro(items, "companies.item")
+
+    # The concurrency slot is held, and the stream closed, around the whole read
+    async with stream_chat_completion(
+        client,
+        model=EXTRACT_MODEL,
+        messages=messages,
+        temperature=0.0,
+        response_format=_EXTRACT_RESPONSE_FORMAT
+    ) as stream:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+            chunks.append(delta)
+            if parser is not None:
+                parser.send(delta.encode())
+                for company in items:
+                    on_company(company)
+                del items[:]
+
+    result = orjson.loads("".join(chunks))
+    if parser is None:
+        for company in result.get("companies", []):
+            on_company(company)
+    return result
+
+async def extract_data_with_llm_async(
+    content_markdown: str,
+    interactive_html: str,
+    query: str,
+    on_company: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Async variant of extract_data_with_llm on the shared AsyncOpenAI client.
+    Calls from every crawl share the process-wide OpenAI concurrency limit.
+    With `on_company`, the response is streamed and each company is passed to it
+    while the rest of the response is still being generated.
+    """
+    client = get_async_client()
+    if client is None:
+        logger.warning("No OpenAI API Key. Returning empty extraction.")
+        return dict(_EMPTY_EXTRACTION)
+
+    key = _extraction_key(content_markdown, interactive_html, query)
+    cached = _EXTRACTION_CACHE.get(key)
+    if cached is not None:
+        if on_company is not None:
+            for company in cached.get("companies", []):
+                on_company(company)
+        return cached
+
+    model = EXTRACT_MODEL
+    # Token counting in the prefilter is CPU-bound, keep it off the event loop
+    messages = await asyncio.to_thread(build_extraction_messages, content_markdown, interactive_html, query)
+
+    # Companies already handed to `on_company`, reported even if the stream fails midway
+    emitted: List[Dict[str, Any]] = []
+
+    def emit(company: Dict[str, Any]) -> None:
+        emitted.append(company)
+        on_company(company)
+
+    try:
+        if on_company is not None:
+            result = await _stream_extraction(client, messages, emit)
+        else:
+            response = await create_chat_completion(
+                client,
+                model=model,
+                messages=messages,
+                temperature=0.0,
+                response_format=_EXTRACT_RESPONSE_FORMAT
+            )
+            result = orjson.loads(response.choices[0].message.content)
+        _EXTRACTION_CACHE.set(key, result)
+        return result
+
+    except Exception as e:
+        logger.warning("LLM Extraction Error: %s", e)
+        # Streamed companies have already reached the client; keep them in the page's result
+        return {**_EMPTY_EXTRACTION, "companies": emitted}
+
+def submit_extraction_batch(pages: List[Tuple[str, str, str]]) -> str:
+    """
+    Submits (content_markdown, html_content, query) pages to the OpenAI Batch API.
+    Each page's custom_id is "page-<index>". Returns the batch id.
+    For non-interactive crawl jobs only; the UI uses extract_data_with_llm.
+    """
+    if not USE_BATCH_API:
+        raise RuntimeError("Batch API disabled, set USE_BATCH_API=1")
+    client = get_client()
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+
+    lines = []
+    for i, (content_markdown, html_content, query) in enumerate(pages):
+        lines.append(orjson.dumps({
+            "custom_id": f"page-{i}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": EXTRACT_MODEL,
+                "messages": build_extraction_messages(content_markdown, preprocess_page(html_content)[1], query),
+                "temperature": 0.0,
+                "response_format": _EXTRACT_RESPONSE_FORMAT,
+            },
+        }))
+
+    batch_file = client.files.create(file=("extraction_batch.jsonl", b"\n".join(lines)), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    logger.debug("Submitted extraction batch %s with %s pages", batch.id, len(pages))
+    return batch.id
+
+def collect_extraction_batch(batch_id: str) -> Optional[Dict[str, Dict[str, Any]]]:
+    """
+    Polls a batch submitted with submit_extraction_batch.
+    Returns None while it is still running, otherwise {custom_id: extraction result} for
+    every submitted page (failed, expired or cancelled pages map to an empty extraction).
+    """
+    client = get_client()
+    if client is None:
+        raise RuntimeError("OPENAI_API_KEY is not set")
+
+    batch = client.batches.retrieve(batch_id)
+    if batch.status in ("validating", "in_progress", "finalizing", "cancelling"):
+        return None
+    if batch.status != "completed":
+        logger.warning("Extraction batch %s ended with status %s", batch_id, batch.status)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    # Successful requests land in the output file, request-level failures in the error file
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in client.files.content(file_id).read().splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            try:
+                content = record["response"]["body"]["choices"][0]["message"]["content"]
+                results[record["custom_id"]] = orjson.loads(content)
+            except (KeyError, IndexError, TypeError, orjson.JSONDecodeError) as e:
+                logger.warning("Batch extraction failed for %s: %s", record.get("custom_id"), record.get("error") or e)
+                results[record.get("custom_id")] = dict(_EMPTY_EXTRACTION)
+
+    # Requests that never ran (batch expired or cancelled) are in neither file
+    total = batch.request_counts.total if batch.request_counts else 0
+    for i in range(total):
+        results.setdefault(f"page-{i}", dict(_EMPTY_EXTRACTION))
+    return results
@@ -1,53 +1,31 @@
-from typing import List, Dict
-import os
-import json
+import asyncio
+import logging
+import re
+from typing import List, Dict, Tuple
+from urllib.parse import urlsplit
+import orjson
+from services.openai_client import create_chat_completion, get_async_client
+from services.urls import canonicalize_url
 
-# Try to import openai, but handle if it's not present (though we should probably add it to requirements)
-try:
-    from openai import OpenAI
-except ImportError:
-    OpenAI = None
+__all__ = ["FILTER_BATCH_SIZE", "SYSTEM_PROMPT_FILTER", "filter_search_results", "filter_search_results_batch"]
 
-def filter_search_results(results: List[Dict[str, str]], query: str) -> List[str]:
-    """
-    Filters search results based on the query using an LLM.
-    Returns a list of URLs that are relevant.
-    """
-    if not results:
-        return []
+logger = logging.getLogger(__name__)
 
-    # If OpenAI is not available or no key, return all results (fail open)
-    # This is a placeholder. ideally we should have a free LLM or user provided key.
-    # The user mentioned "Crawl4AI with its AI capabilities", but that's for extraction.
-    # For now, let's use a dummy filter if no key, or try to use a free provider if possible.
-    # Actually, let's simply return all results if we can't filter, but print a warning.
-    
-    # Check for API Key
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not OpenAI or not api_key:
-        print("Warning: OpenAI client not available or API key missing. Skipping LLM filtering.")
-        return [r.get("url") for r in results if r.get("url")]
-
-    client = OpenAI(api_key=api_key)
-    
-    # Prepare the prompt
-    candidates = ""
-    for i, r in enumerate(results):
-        content = r.get('content', '') or r.get('snippet', '') or r.get('description', '')
-        snippet_preview = content[:300] if content else 'No snippet available'
-        candidates += f"{i}. URL: {r.get('url', 'No URL')}\n   Title: {r.get('title', 'No title')}\n   Snippet: {snippet_preview}\n\n"
-    
-    print(f"\n=== LLM Filter Input ===")
-    print(f"Query: {query}")
-    print(f"Number of candidates: {len(results)}")
-    print(f"\nCandidates:\n{candidates}")
-    print(f"========================\n")
-
-    system_prompt = f"""You are a URL filter. Your job is to pick URLs that will help find companies matching the user's search intent.
-
-User is searching for: "{query}"
-
-YOUR TASK: Select URLs that are likely to have COMPANY LISTINGS or COMPANY INFORMATION matching the user's query.
+# Hosts the filter prompt always rejects (social, wiki, jobs, marketplaces, forums): dropped without an LLM call
+DENY_HOST_RE = re.compile(r"(?:^|\.)(?:linkedin|facebook|wikipedia|amazon|ebay|indeed|reddit|quora)\.")
+
+# Characters of each result's snippet shown to the LLM
+SNIPPET_LEN = 250
+
+# Max number of (query, results) jobs sent in a single chat completion
+FILTER_BATCH_SIZE = 10
+
+# Query-agnostic so the prefix is identical across calls (OpenAI prompt caching)
+SYSTEM_PROMPT_FILTER = """You are a URL filter. Your job is to pick URLs that will help find companies matching each user's search intent.
+
+You will receive one or more search queries (q0, q1, ...), each with its own numbered search results.
+
+YOUR TASK: For each query, select URLs that are likely to have COMPANY LISTINGS or COMPANY INFORMATION matching that query.
 
 GOOD URLs (SELECT these):
 ✅ Business directories (e.g., "Nepal Business Directory", "Cosmetics Suppliers List")
@@ -67,54 +45,152 @@ BAD URLs (SKIP these):
 ❌ Login/signup pages
 ❌ Error pages
 
-SIMPLE RULE: Will this URL help find companies that match "{query}"?
+SIMPLE RULE: Will this URL help find companies that match its query?
 - If YES → Include it
 - If NO → Skip it
 
-Return a JSON array of the indices of relevant URLs.
-Example: [0, 2, 4]
-If nothing is relevant: []"""
+Return a JSON object mapping each query id to the array of indices of its relevant URLs.
+Example: {"q0": [0, 2, 4], "q1": []}
+If nothing is relevant for a query, use an empty array.
 
-    user_prompt = f"User Query: '{query}'\n\nSearch Results:\n{candidates}\n\nWhich URLs will help find companies matching this query? Return JSON array of indices."
+The user message lists each query followed by its numbered search results."""
+
+def _selection_schema(num_queries: int) -> Dict:
+    """
+    Strict structured-output schema for a batch: one array of indices per query id (q0, q1, ...).
+    """
+    query_ids = [f"q{q}" for q in range(num_queries)]
+    return {
+        "type": "object",
+        "properties": {qid: {"type": "array", "items": {"type": "integer"}} for qid in query_ids},
+        "required": query_ids,
+        "additionalProperties": False,
+    }
+
+def _is_denied(canonical_url: str) -> bool:
+    return bool(DENY_HOST_RE.search(urlsplit(canonical_url).netloc))
+
+def prefilter_results(results: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Drops results without a URL, on a denied host, or duplicating an earlier result's
+    canonical URL, so only distinct uncertain candidates reach the LLM.
+    """
+    seen = set()
+    kept = []
+    for r in results:
+        canonical = canonicalize_url(r.get("url") or "")
+        if not canonical or canonical in seen or _is_denied(canonical):
+            continue
+        seen.add(canonical)
+        kept.append(r)
+    return kept
+
+def _all_urls(results: List[Dict[str, str]]) -> List[str]:
+    return [r.get("url") for r in results if r.get("url")]
+
+async def filter_search_results(results: List[Dict[str, str]], query: str) -> List[str]:
+    """
+    Filters search results based on the query using an LLM.
+    Returns a list of URLs that are relevant.
+    """
+    return (await filter_search_results_batch([(query, results)]))[0]
+
+async def filter_search_results_batch(jobs: List[Tuple[str, List[Dict[str, str]]]]) -> List[List[str]]:
+    """
+    Filters the search results of several queries, sending up to FILTER_BATCH_SIZE
+    queries per LLM call so the long system prompt is paid once per batch.
+    Batches run concurrently. Returns one list of relevant URLs per job, in order.
+    """
+    # LLM indices refer to positions in the pre-filtered lists
+    jobs = [(query, prefilter_results(results)) for query, results in jobs]
+    batches = await asyncio.gather(*(
+        _filter_batch(jobs[start:start + FILTER_BATCH_SIZE])
+        for start in range(0, len(jobs), FILTER_BATCH_SIZE)
+    ))
+    return [urls for batch in batches for urls in batch]
+
+async def _filter_batch(jobs: List[Tuple[str, List[Dict[str, str]]]]) -> List[List[str]]:
+    # Jobs without candidates need no LLM call
+    if not any(results for _, results in jobs):
+        return [[] for _ in jobs]
+
+    # If OpenAI is not available or no key, return all results (fail open)
+    # This is a placeholder. ideally we should have a free LLM or user provided key.
+    # The user mentioned "Crawl4AI with its AI capabilities", but that's for extraction.
+    # For now, let's use a dummy filter if no key, or try to use a free provider if possible.
+    # Actually, let's simply return all results if we can't filter, but print a warning.
+
+    # Check for API Key
+    client = get_async_client()
+    if client is None:
+        logger.warning("OpenAI client not available or API key missing. Skipping LLM filtering.")
+        return [_all_urls(results) for _, results in jobs]
+
+    # Prepare the prompt: candidates are numbered per query as qN.i
+    sections = ""
+    for q, (query, results) in enumerate(jobs):
+        sections += f"=== q{q}: User is searching for: \"{query}\" ===\n\n"
+        for i, r in enumerate(results):
+            content = r.get('content', '') or r.get('snippet', '') or r.get('description', '')
+            snippet_preview = content[:SNIPPET_LEN] if content else 'No snippet available'
+            sections += f"q{q}.{i}. URL: {r.get('url', 'No URL')}\n   Title: {r.get('title', 'No title')}\n   Snippet: {snippet_preview}\n\n"
+
+    logger.debug(
+        "LLM filter input: queries=%s, %s candidates:\n%s",
+        [query for query, _ in jobs], sum(len(results) for _, results in jobs), sections
+    )
+
+    # Queries and candidates only; the instructions live in the cached system prefix
+    user_prompt = f"Search Results:\n{sections}"
 
     try:
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
+            client,
             model="gpt-4o-mini",  # Better understanding of business/directory pages
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": SYSTEM_PROMPT_FILTER},
                 {"role": "user", "content": user_prompt}
             ],
-            temperature=0.0
+            temperature=0.0,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "url_selection", "schema": _selection_schema(len(jobs)), "strict": True}
+            }
         )
-        
+
         content = response.choices[0].message.content.strip()
-        print(f"\n=== LLM Filter Response ===")
-        print(f"Raw response: {content}")
-        print(f"============================\n")
-        
+        logger.debug("LLM filter raw response: %s", content)
+
         # Parse output
         try:
-            indices = json.loads(content)
-            if isinstance(indices, list):
-                valid_urls = []
-                for idx in indices:
-                    if isinstance(idx, int) and 0 <= idx < len(results):
-                        url = results[idx].get("url")
-                        if url:
-                            valid_urls.append(url)
-                            print(f"  ✓ Selected [{idx}]: {url}")
-                print(f"\n✅ LLM Filtered {len(results)} -> {len(valid_urls)} URLs")
-                return valid_urls
-            else:
-                print(f"❌ LLM response is not a list: {indices}")
-                return [r.get("url") for r in results if r.get("url")] # Fail open
-        except json.JSONDecodeError as e:
-            print(f"❌ Failed to parse LLM response as JSON: {content}")
-            print(f"   Error: {e}")
-            return [r.get("url") for r in results if r.get("url")] # Fail open
+            selections = orjson.loads(content)
+        except orjson.JSONDecodeError as e:
+            logger.warning("Failed to parse LLM response as JSON (%s): %s", e, content)
+            return [_all_urls(results) for _, results in jobs] # Fail open
 
-    except Exception as e:
-        print(f"Error calling LLM: {e}")
-        return [r.get("url") for r in results if r.get("url")] # Fail open
+        if not isinstance(selections, dict):
+            logger.warning("LLM response is not an object: %s", selections)
+            return [_all_urls(results) for _, results in jobs] # Fail open
 
-    return [r.get("url") for r in results if r.get("url")]
+        filtered = []
+        for q, (query, results) in enumerate(jobs):
+            indices = selections.get(f"q{q}")
+            if not isinstance(indices, list):
+                logger.warning("No selection list for q%s, keeping all results", q)
+                filtered.append(_all_urls(results)) # Fail open
+                continue
+
+            valid_urls = []
+            for idx in indices:
+                if isinstance(idx, int) and 0 <= idx < len(results):
+                    url = results[idx].get("url")
+                    if url:
+                        valid_urls.append(url)
+                        logger.debug("  Selected [q%s.%s]: %s", q, idx, url)
+            logger.debug("LLM Filtered %s -> %s URLs for '%s'", len(results), len(valid_urls), query)
+            filtered.append(valid_urls)
+        return filtered
+
+    except Exception as e:
+        logger.warning("Error calling LLM: %s", e)
+        return [_all_urls(results) for _, results in jobs] # Fail open
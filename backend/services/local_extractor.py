@@ -1,16 +1,126 @@
+import hashlib
+import html
 import re
-from bs4 import BeautifulSoup
-from typing import List, Dict, Any, Optional
+from functools import lru_cache
+from itertools import chain, islice
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urljoin, urlparse
 
-def check_relevance_local(markdown_text: str, query: str) -> bool:
+from services.cache import TTLCache
+from services.process_pool import map_in_process
+
+# selectolax's lexbor parser (C, HTML5) is the fast path; BeautifulSoup is the fallback
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    from bs4 import BeautifulSoup, SoupStrainer
+except ImportError:
+    BeautifulSoup = SoupStrainer = None
+
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}")
+# Matches patterns like +1-555-555-5555 or (555) 555-5555
+PHONE_RE = re.compile(r"\+?\d{1,3}[-.\s]?\(?\d{2,4}\)?[-.\s]?\d{3,4}[-.\s]?\d{3,4}")
+NONDIGIT_RE = re.compile(r"\D")
+# Quoted href of every <a> tag, scanned over the raw bytes instead of walking a parsed tree
+HREF_RE = re.compile(rb'<a\b[^>]*?\bhref\s*=\s*["\']([^"\']+)["\']', re.I)
+# Title and meta description, also read straight from the raw bytes (either attribute order for the meta tag)
+TITLE_RE = re.compile(rb"<title[^>]*>([^<]*)</title", re.I)
+META_DESC_RE = re.compile(
+    rb'<meta\b[^>]*?\bname\s*=\s*["\']description["\'][^>]*?\bcontent\s*=\s*(?:"([^"]*)"|\'([^\']*)\')'
+    rb'|<meta\b[^>]*?\bcontent\s*=\s*(?:"([^"]*)"|\'([^\']*)\')[^>]*?\bname\s*=\s*["\']description["\']',
+    re.I,
+)
+
+# pyahocorasick finds every keyword in one C pass over the text; without it each keyword is its own `in` scan
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Negative Keywords (Skip these sites unless they are directories)
+NEGATIVE_KEYWORDS = ("ministry", "government", "department", "policy", "regulations", "act", "software", "visualization", "tableau")
+DIRECTORY_KEYWORDS = ("directory", "list", "companies", "members")
+# Raw HTML beyond this many characters is ignored; multi-MB directory pages are mostly repeated markup
+MAX_HTML_CHARS = 1_000_000
+# Subtrees with no visible text, removed before text extraction
+NON_TEXT_TAGS = ("script", "style", "noscript", "svg", "template")
+
+RELEVANCE_KEYWORDS = ("distributor", "supplier", "wholesale", "manufacturer", "dealer", "provider", "company", "companies", "business", "trader")
+
+def _build_automaton(words):
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+    automaton.make_automaton()
+    return automaton
+
+def _build_tagged_automaton(groups: Dict[str, Tuple[str, ...]]):
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for tag, words in groups.items():
+        for word in words:
+            automaton.add_word(word, tag)
+    automaton.make_automaton()
+    return automaton
+
+# Negative and directory terms in one automaton, each match tagged with its group
+_NEG_AC = _build_tagged_automaton({"neg": NEGATIVE_KEYWORDS, "dir": DIRECTORY_KEYWORDS})
+_POS_AC = _build_automaton(RELEVANCE_KEYWORDS)
+
+def _found_terms(automaton, words, text_lower: str) -> set:
     """
-    Checks if the page is relevant based on keyword matching in the markdown content.
+    Returns which of `words` occur (as substrings) in `text_lower`.
     """
+    if automaton is not None:
+        return {word for _, word in automaton.iter(text_lower)}
+    return {word for word in words if word in text_lower}
+
+def _is_non_directory_negative(text_lower: str) -> bool:
+    """
+    True if the text has a negative keyword but no directory keyword.
+    Stops scanning as soon as both kinds have been seen.
+    """
+    if _NEG_AC is None:
+        return any(k in text_lower for k in NEGATIVE_KEYWORDS) and not any(k in text_lower for k in DIRECTORY_KEYWORDS)
+    has_neg = has_dir = False
+    for _, tag in _NEG_AC.iter(text_lower):
+        if tag == "neg":
+            has_neg = True
+        else:
+            has_dir = True
+        if has_neg and has_dir:
+            return False
+    return has_neg
+
+class ParsedPage(NamedTuple):
+    """
+    One parse of a page, shared by check_relevance_local and extract_companies_local.
+    """
+    text: str
+    title: str
+    description: str
+    hrefs: List[str]
+
+def check_relevance_local(markdown_text: Union[str, ParsedPage], query: str, text_lower: Optional[str] = None) -> bool:
+    """
+    Checks if the page is relevant based on keyword matching in the markdown content,
+    or in the visible text of a page already parsed with parse_page.
+    Callers that already lower-cased the page text can pass it as `text_lower`.
+    """
+    if isinstance(markdown_text, ParsedPage):
+        markdown_text = markdown_text.text
     if not markdown_text:
         return False
         
-    query_terms = query.lower().split()
-    text_lower = markdown_text.lower()
+    query_lower = query.lower()
+    if text_lower is None:
+        text_lower = markdown_text.lower()
     
     # Check if ANY query term is present (loose relevance)
     # Refine this logic as needed (e.g., ALL terms, or specific keywords like 'distributor')
@@ -18,135 +128,237 @@ def check_relevance_local(markdown_text: str, query: str) -> bool:
     # Heuristic: If looking for "distributors", the page should probably contain that word
     # or "supplier", "wholesale", "manufacturer".
     
-    # Negative Keywords (Skip these sites unless they are directories)
-    negative_keywords = ["ministry", "government", "department", "policy", "regulations", "act", "software", "visualization", "tableau"]
-    
-    if any(nk in text_lower for nk in negative_keywords) and not any(dk in text_lower for dk in ["directory", "list", "companies", "members"]):
+    # Stricter: If country is in query, it MUST be in text (approximate).
+    # Cheapest check, so it runs first and skips the keyword scans entirely
+    if "thailand" in query_lower and "thai" not in text_lower:
+         return False
+
+    # Skip sites with negative keywords unless they are directories
+    if _is_non_directory_negative(text_lower):
         return False
 
-    keywords = ["distributor", "supplier", "wholesale", "manufacturer", "dealer", "provider", "company", "companies", "business", "trader"]
-    
-    # Add query terms to keywords - strict check for country if present
-    query_parts = [t for t in query.lower().split() if len(t) > 3]
-    keywords.extend(query_parts)
+    # Add query terms to keywords
+    query_parts = [t for t in query_lower.split() if len(t) > 3]
     
-    matches = sum(1 for k in keywords if k in text_lower)
-    
-    # Stricter: If country is in query, it MUST be in text (approximate)
-    if "thailand" in query.lower() and "thailand" not in text_lower and "thai" not in text_lower:
-         return False
+    matches = len(_found_terms(_POS_AC, RELEVANCE_KEYWORDS, text_lower)) + sum(1 for k in query_parts if k in text_lower)
     
     return matches >= 2 # At least 2 keyword matches
 
-def extract_companies_local(html_content: str, source_url: str) -> Dict[str, Any]:
+def _parse_lexbor(html_bytes: bytes) -> str:
+    tree = LexborHTMLParser(html_bytes)
+    tree.strip_tags(list(NON_TEXT_TAGS))
+    root = tree.body or tree.root
+    return root.text(separator=" ", strip=True) if root else ""
+
+def _parse_soup(html_bytes: bytes) -> str:
+    # Only build the visible-text part of the tree
+    soup = BeautifulSoup(html_bytes, "lxml", parse_only=SoupStrainer("body"))
+    for tag in soup(NON_TEXT_TAGS):
+        tag.decompose()
+    return soup.get_text(separator=" ", strip=True)
+
+def _decode_group(raw: bytes) -> str:
+    # Only the small captured group is decoded; raw markup may hold entities such as &amp;
+    text = raw.decode("utf-8", "ignore").strip()
+    return html.unescape(text) if "&" in text else text
+
+def _extract_title(html_bytes: bytes) -> str:
+    m = TITLE_RE.search(html_bytes)
+    return _decode_group(m.group(1)) if m else ""
+
+def _extract_description(html_bytes: bytes) -> str:
+    m = META_DESC_RE.search(html_bytes)
+    if not m:
+        return ""
+    return _decode_group(next(g for g in m.groups() if g is not None))
+
+def _extract_hrefs(html_bytes: bytes) -> List[str]:
+    return [_decode_group(m.group(1)) for m in HREF_RE.finditer(html_bytes)]
+
+def parse_page(html_content: str) -> ParsedPage:
+    """
+    Parses the page once into its visible text, title, meta description and raw hrefs.
+    The document is capped at MAX_HTML_CHARS and encoded once; title, description and
+    hrefs are regex scans over those bytes, and only the visible text needs a parser.
+    """
+    html_content = html_content[:MAX_HTML_CHARS]
+    html_bytes = html_content.encode("utf-8", "ignore")
+    title = _extract_title(html_bytes)
+    description = _extract_description(html_bytes)
+    hrefs = _extract_hrefs(html_bytes)
+    if LexborHTMLParser:
+        try:
+            return ParsedPage(_parse_lexbor(html_bytes), title, description, hrefs)
+        except Exception:
+            if not BeautifulSoup:
+                raise
+            # Malformed document lexbor can't handle, retry with the forgiving parser
+    return ParsedPage(_parse_soup(html_bytes), title, description, hrefs)
+
+# URL substrings of links that are never company sites (social, legal, account, search pages...),
+# matched in one regex pass per link
+LINK_BLACKLIST = (
+    "facebook.com", "twitter.com", "instagram.com", "linkedin.com", "youtube.com",
+    "google.com", "wikipedia.org", ".gov", "policies", "terms", "contact", "about",
+    "login", "signin", "register", "signup", "cart", "checkout", "account", "profile",
+    "ad-create", "advertise", "member", "forgot", "reset", "search", "filter", "sort",
+    "privacy", "disclaimer", "sitemap", "quote", "checklist", "consultants", "services",
+    "associates", "lawyers", "insurance", "designers", "compliance", "labeling"
+)
+BLACKLIST_RE = re.compile("|".join(re.escape(s) for s in LINK_BLACKLIST))
+_SKIP_SCHEMES = ("javascript:", "mailto:", "tel:")
+
+# Potential company links returned per page
+MAX_COMPANY_LINKS = 20
+
+# Local extraction results keyed by (page content hash, source URL), kept for a day so
+# retries and re-runs over unchanged pages skip the parse
+_LOCAL_EXTRACTION_CACHE = TTLCache(maxsize=2048, ttl=86400)
+
+def _local_extraction_key(html_content: str, source_url: str) -> Tuple[str, str]:
+    digest = hashlib.blake2b(html_content[:MAX_HTML_CHARS].encode("utf-8", "ignore"), digest_size=16).hexdigest()
+    return digest, source_url
+
+@lru_cache(maxsize=8192)
+def _netloc(url: str) -> str:
+    # The same hosts recur across a page's links and across pages
+    return urlparse(url).netloc
+
+def extract_companies_local(html_content: str, source_url: str, page: Optional[ParsedPage] = None) -> Dict[str, Any]:
     """
-    Extracts company information from HTML using heuristics (Regex/Soup).
+    Extracts company information from HTML using heuristics (Regex/selectolax).
     Returns a dictionary representing a single 'aggregated' company result for the page,
     or a list if we could identify distinct blocks (harder without LLM).
     
     For now, we treat the PAGE as the entity (e.g. a directory listing might be hard to parse company-by-company without LLM).
     But we can extract ALL emails/phones found.
+    Returns {} for empty pages; relevance filtering is left to check_relevance_local.
+    Callers that already ran parse_page (e.g. for check_relevance_local) pass the result
+    as `page` so the HTML isn't parsed again. Results are cached per (content, source URL).
     """
-    if not html_content:
-        return {}
-        
-    soup = BeautifulSoup(html_content, "lxml")
-    text_content = soup.get_text(separator=" ", strip=True)
+    key = None
+    if html_content:
+        key = _local_extraction_key(html_content, source_url)
+        cached = _LOCAL_EXTRACTION_CACHE.get(key)
+        if cached is not None:
+            return cached
+
+    if page is None:
+        if not html_content:
+            return {}
+
+        page = parse_page(html_content)
+
+    text_content, title, description, hrefs = page
     
     # 1. Title as Name
-    title = soup.title.string.strip() if soup.title else "Unknown"
+    title = title or "Unknown"
     
     # 2. Emails
-    emails = list(set(re.findall(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}", text_content)))
+    # Distinct in page order; only the first three are reported
+    emails = list(islice(dict.fromkeys(EMAIL_RE.findall(text_content)), 3))
     
     # 3. Phones (Simple heuristic)
-    # Matches patterns like +1-555-555-5555 or (555) 555-5555
-    phones = list(set(re.findall(r"(\+?\d{1,3}[-.\s]?\(?\d{2,4}\)?[-.\s]?\d{3,4}[-.\s]?\d{3,4})", text_content)))
-    phones = [p for p in phones if len(re.sub(r"\D", "", p)) > 8] # Filter short numbers
+    phones = list(islice((p for p in dict.fromkeys(PHONE_RE.findall(text_content)) if len(NONDIGIT_RE.sub("", p)) > 8), 3)) # Filter short numbers
     
-    # 4. Description (Meta)
-    description = ""
-    meta_desc = soup.find("meta", attrs={"name": "description"})
-    if meta_desc:
-        description = meta_desc.get("content", "").strip()
+    # 4. Description (Meta), parsed above
     
     # 5. Website (External links) - Deep Crawl Strategy
     # Find all external links that might be companies
-    from urllib.parse import urljoin, urlparse # Import inside function or at top
-    
-    company_links = []
-    
-    # exclude patterns for links
-    link_blacklist = [
-        "facebook.com", "twitter.com", "instagram.com", "linkedin.com", "youtube.com",
-        "google.com", "wikipedia.org", ".gov", "policies", "terms", "contact", "about",
-        "login", "signin", "register", "signup", "cart", "checkout", "account", "profile",
-        "ad-create", "advertise", "member", "forgot", "reset", "search", "filter", "sort",
-        "privacy", "disclaimer", "sitemap", "quote", "checklist", "consultants", "services",
-        "associates", "lawyers", "insurance", "designers", "compliance", "labeling"
-    ]
-    
-    source_domain = urlparse(source_url).netloc
-    external_links = []
-    internal_links = []
+    source_domain = _netloc(source_url)
+    # Insertion-ordered dicts dedupe as links are classified
+    external_links: Dict[str, None] = {}
+    internal_links: Dict[str, None] = {}
 
-    for link in soup.find_all("a", href=True):
-        raw_href = link["href"]
+    for raw_href in hrefs:
         
-        # Skip javascript:, mailto:, tel:
-        if any(x in raw_href.lower() for x in ["javascript:", "mailto:", "tel:", "#"]):
+        # Skip javascript:, mailto:, tel: and in-page anchors
+        raw_lower = raw_href.lower()
+        if raw_lower.startswith(_SKIP_SCHEMES) or "#" in raw_href:
             continue
             
-        # Resolve relative links
-        href = urljoin(source_url, raw_href)
+        # Resolve relative links (absolute ones, the common case, are used as-is)
+        if raw_lower.startswith(("http://", "https://")):
+            href, href_lower = raw_href, raw_lower
+        else:
+            href = urljoin(source_url, raw_href)
+            href_lower = href.lower()
         
         # Parse domain
-        href_domain = urlparse(href).netloc
+        href_domain = _netloc(href)
         
         # Filter out invalid or blacklisted
-        if not href.startswith("http"):
+        if not href_lower.startswith("http") or href == source_url:
             continue
             
-        if any(x in href.lower() for x in link_blacklist):
+        if BLACKLIST_RE.search(href_lower):
             continue
             
         # Classify
         if source_domain in href_domain:
              # Internal-ish
-             internal_links.append(href)
+             internal_links[href] = None
         else:
              # External
-             external_links.append(href)
+             external_links[href] = None
+             # Enough external links to fill the result, internal ones would never be used
+             if len(external_links) >= MAX_COMPANY_LINKS:
+                 break
     
     # Dedup and prioritize
     # 1. External links are best (actual company websites)
-    seen = set()
-    for l in external_links:
-        if l not in seen and l != source_url:
-            company_links.append(l)
-            seen.add(l)
-            
     # 2. If we have very few external links, maybe deep crawl internal profiles?
     # But for CosmeticIndex, internal links were noise. Let's be careful.
-    # Only add internal links if they look like "profiles" (heuristic?)
     # For now, append unique internal links after external, limiting total
-    for l in internal_links:
-        if l not in seen and l != source_url:
-            company_links.append(l)
-            seen.add(l)
+    # Both dicts are already deduplicated and a link lands in only one of them
+    company_links = list(islice(chain(external_links, internal_links), MAX_COMPANY_LINKS))
     
     # Structured output simulating the LLM response
     company = {
         "name": title,
         "website": source_url, # Default to the page URL
         "description": description if description else title,
-        "email": ", ".join(emails[:3]) if emails else None, # key contacts
-        "phone": ", ".join(phones[:3]) if phones else None,
+        "email": ", ".join(emails) if emails else None, # key contacts
+        "phone": ", ".join(phones) if phones else None,
         "address": None # Hard to extract with regex
     }
     
-    return {
+    result = {
         "companies": [company], 
         "next_page_url": None,
-        "company_links": company_links[:20] # Return top 20 potential company links, prioritized by external
+        "company_links": company_links # Top 20 potential company links, prioritized by external
     }
+    if key is not None:
+        _LOCAL_EXTRACTION_CACHE.set(key, result)
+    return result
+
+def extract_companies_batch(pages: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+    """
+    Runs extract_companies_local over `(html_content, source_url)` pairs, parsing the
+    uncached pages in parallel on the shared process pool. Results are in input order.
+    """
+    results: List[Optional[Dict[str, Any]]] = [None] * len(pages)
+    misses = []
+    for i, (html_content, source_url) in enumerate(pages):
+        # Workers have their own caches, so hits are resolved here before anything is pickled
+        cached = _LOCAL_EXTRACTION_CACHE.get(_local_extraction_key(html_content, source_url)) if html_content else None
+        if cached is not None:
+            results[i] = cached
+        else:
+            misses.append(i)
+
+    if len(misses) == 1:
+        # Not worth a round trip through the pool
+        i = misses[0]
+        results[i] = extract_companies_local(*pages[i])
+    elif misses:
+        extracted = map_in_process(
+            extract_companies_local,
+            [pages[i][0] for i in misses],
+            [pages[i][1] for i in misses],
+        )
+        for i, result in zip(misses, extracted):
+            results[i] = result
+            if result:
+                _LOCAL_EXTRACTION_CACHE.set(_local_extraction_key(*pages[i]), result)
+    return results
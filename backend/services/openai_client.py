@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import importlib.util
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+import httpx
+from openai import OpenAI, AsyncOpenAI, AsyncStream, DefaultHttpxClient, DefaultAsyncHttpxClient, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# One pooled client per flavour, shared by every LLM call so keep-alive/TLS sessions persist
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+# HTTP/2 needs the optional `h2` package
+_HTTP2 = importlib.util.find_spec("h2") is not None
+
+# Max number of OpenAI requests in flight across all streams, keeps bursts under the account RPM
+OPENAI_CONCURRENCY = 16
+_LLM_SEMAPHORE = asyncio.Semaphore(OPENAI_CONCURRENCY)
+
+# Extra attempts on 429 after the SDK's own retries, with exponential backoff (1s, 2s, 4s)
+_RATE_LIMIT_ATTEMPTS = 4
+
+_client: Optional[OpenAI] = None
+_async_client: Optional[AsyncOpenAI] = None
+
+def get_client() -> Optional[OpenAI]:
+    """
+    Returns the shared blocking OpenAI client, or None if OPENAI_API_KEY is not set.
+    """
+    global _client
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    if _client is None:
+        _client = OpenAI(api_key=api_key, http_client=DefaultHttpxClient(limits=_LIMITS, http2=_HTTP2))
+    return _client
+
+def get_async_client() -> Optional[AsyncOpenAI]:
+    """
+    Returns the shared AsyncOpenAI client, or None if OPENAI_API_KEY is not set.
+    """
+    global _async_client
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    if _async_client is None:
+        _async_client = AsyncOpenAI(api_key=api_key, http_client=DefaultAsyncHttpxClient(limits=_LIMITS, http2=_HTTP2))
+    return _async_client
+
+async def create_chat_completion(client: AsyncOpenAI, **kwargs):
+    """
+    Runs client.chat.completions.create under the process-wide concurrency limit,
+    backing off exponentially when the API answers with a rate limit error.
+    """
+    for attempt in range(_RATE_LIMIT_ATTEMPTS):
+        try:
+            async with _LLM_SEMAPHORE:
+                return await client.chat.completions.create(**kwargs)
+        except RateLimitError:
+            if attempt == _RATE_LIMIT_ATTEMPTS - 1:
+                raise
+            delay = 2 ** attempt
+            logger.warning("OpenAI rate limited, retrying in %ss", delay)
+            # Sleep outside the semaphore so other calls can use the slot
+            await asyncio.sleep(delay)
+
+@asynccontextmanager
+async def stream_chat_completion(client: AsyncOpenAI, **kwargs) -> AsyncIterator[AsyncStream]:
+    """
+    Opens a streamed chat completion under the process-wide concurrency limit.
+    The slot is held until the block exits, so streams being read count as in flight,
+    and the stream is closed on exit (including cancellation). Rate limit errors on
+    opening are retried like create_chat_completion.
+    """
+    for attempt in range(_RATE_LIMIT_ATTEMPTS):
+        async with _LLM_SEMAPHORE:
+            try:
+                stream = await client.chat.completions.create(stream=True, **kwargs)
+            except RateLimitError:
+                if attempt == _RATE_LIMIT_ATTEMPTS - 1:
+                    raise
+            else:
+                async with stream:
+                    yield stream
+                return
+        delay = 2 ** attempt
+        logger.warning("OpenAI rate limited, retrying in %ss", delay)
+        # Sleep outside the semaphore so other calls can use the slot
+        await asyncio.sleep(delay)
+
+async def close_clients() -> None:
+    """
+    Closes the shared clients and their connection pools (called on app shutdown).
+    """
+    global _client, _async_client
+    if _async_client is not None:
+        await _async_client.close()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,113 @@
+import logging
+import re
+from functools import lru_cache
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# tiktoken gives exact token counts; without it we fall back to a ~4 chars/token estimate
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+PHONE_RE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+TABLE_ROW_RE = re.compile(r"^\s*\|.*\|\s*$", re.MULTILINE)
+LIST_ITEM_RE = re.compile(r"^\s*(?:\d+[.)]|[-*+])\s+", re.MULTILINE)
+BLOCK_SPLIT_RE = re.compile(r"\n\s*\n")
+
+# Token budgets for the extractor prompt: page content (~32 000 chars of typical page text)
+# and interactive elements (pagination candidates)
+BUDGET_CONTENT = 8000
+BUDGET_PAGINATION = 1500
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    if tiktoken is None:
+        return None
+    try:
+        # Same tokenizer (o200k_base) as the extraction model, so budgets match what is billed
+        return tiktoken.encoding_for_model("gpt-4o-mini")
+    except Exception as e:
+        # The BPE file is downloaded on first use and may be unavailable offline
+        logger.warning("tiktoken unavailable, estimating token counts: %s", e)
+        return None
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cuts text to at most `max_tokens` tokens (estimated at ~4 chars/token without tiktoken).
+    """
+    # Every token covers at least one character, so short text never needs encoding
+    if len(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+def score_block(block: str) -> int:
+    """
+    Scores a markdown block by how likely it is to contain company listings.
+    """
+    score = 0
+    if EMAIL_RE.search(block):
+        score += 2
+    if PHONE_RE.search(block):
+        score += 2
+    if TABLE_ROW_RE.search(block):
+        score += 1
+    if LIST_ITEM_RE.search(block):
+        score += 1
+    return score
+
+def _split_blocks(text: str, budget: int) -> List[str]:
+    """
+    Splits on blank lines; blocks too large to ever fit are split further by line,
+    and overlong lines (e.g. minified HTML) into fixed-size windows.
+    """
+    max_chars = budget  # budget // 4 tokens at ~4 chars/token
+    blocks = []
+    for block in BLOCK_SPLIT_RE.split(text):
+        if not block.strip():
+            continue
+        if count_tokens(block) <= budget // 4:
+            blocks.append(block)
+            continue
+        for line in block.splitlines():
+            if not line.strip():
+                continue
+            blocks.extend(line[i:i + max_chars] for i in range(0, len(line), max_chars))
+    return blocks
+
+def select_relevant_text(markdown: str, budget: int = BUDGET_CONTENT) -> str:
+    """
+    Shrinks page markdown to `budget` tokens before LLM extraction.
+    Keeps the highest-scoring blocks (emails, phones, tables, lists) first, then
+    fills the remaining budget in page order. Output preserves the original order.
+    """
+    if not markdown or count_tokens(markdown) <= budget:
+        return markdown
+
+    blocks = _split_blocks(markdown, budget)
+    costs = [count_tokens(block) for block in blocks]
+    ranked = sorted(range(len(blocks)), key=lambda i: (-score_block(blocks[i]), i))
+
+    keep = set()
+    used = 0
+    for i in ranked:
+        if used + costs[i] > budget:
+            continue
+        keep.add(i)
+        used += costs[i]
+
+    return "\n\n".join(blocks[i] for i in sorted(keep))
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Shared worker processes for CPU-bound HTML preprocessing, so pages parse in parallel
+# instead of serializing on the GIL. Created lazily; spawn avoids forking the event loop
+# and open sockets of the server process.
+_pool: Optional[ProcessPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process-wide worker pool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def _discard_broken_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Drops a pool whose worker died (e.g. OOM-killed on a huge page) so the next
+    get_process_pool() starts a fresh one. Other callers may have replaced it already.
+    """
+    global _pool
+    logger.warning("Process pool broken, restarting workers")
+    pool.shutdown(wait=False, cancel_futures=True)
+    if _pool is pool:
+        _pool = None
+
+async def run_in_process(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs a module-level (picklable) function in the worker pool and awaits its result.
+    Retried once on a fresh pool if a worker died.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        return await loop.run_in_executor(get_process_pool(), fn, *args)
+
+def map_in_process(fn: Callable[..., Any], *iterables: Iterable[Any]) -> List[Any]:
+    """
+    Blocking pool.map over the worker pool, returning the results in order.
+    Retried once on a fresh pool if a worker died.
+    """
+    args = [list(it) for it in iterables]
+    pool = get_process_pool()
+    try:
+        return list(pool.map(fn, *args))
+    except BrokenProcessPool:
+        _discard_broken_pool(pool)
+        return list(get_process_pool().map(fn, *args))
+
+def shutdown_process_pool() -> None:
+    """
+    Stops the worker processes (called on app shutdown).
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
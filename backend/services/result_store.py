@@ -0,0 +1,30 @@
+import secrets
+from typing import List, Optional
+from models import Company
+from services.cache import TTLCache
+
+# Results of each /search or /enrich run, kept for download for an hour.
+# Each run gets its own result_id, so concurrent users never overwrite each other.
+_RESULTS = TTLCache(maxsize=256, ttl=3600)
+
+def create_result() -> str:
+    """
+    Registers an empty result set and returns its id.
+    """
+    result_id = secrets.token_urlsafe(12)
+    _RESULTS.set(result_id, [])
+    return result_id
+
+def add_results(result_id: str, companies: List[Company]) -> None:
+    # Stored lists are only touched from the event loop, so in-place extend is safe
+    stored = _RESULTS.get(result_id)
+    if stored is None:
+        stored = []
+        _RESULTS.set(result_id, stored)
+    stored.extend(companies)
+
+def get_results(result_id: str) -> Optional[List[Company]]:
+    """
+    Returns the companies stored under result_id, or None if unknown/expired.
+    """
+    return _RESULTS.get(result_id)
@@ -1,65 +1,112 @@
-import requests
-from typing import List
+import asyncio
+import logging
+import math
+import aiohttp
+import orjson
+from typing import List, Optional
+from services.cache import TTLCache
+from services.http_session import get_session
+from services.urls import canonicalize_url
+
+logger = logging.getLogger(__name__)
 
 SEARXNG_URL = "https://searx.up.railway.app/search"
 
-def search_google(query: str, limit: int = 10) -> List[dict]:
+# Mimic a real browser to avoid 403 Forbidden on some instances
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+}
+
+# Results a SearxNG page usually yields, used to size each wave of concurrent page requests
+RESULTS_PER_PAGE = 10
+MAX_PAGES = 6  # Safety limit
+# Pagination stops after a page where fewer than this share of results are new
+MIN_NEW_RATIO = 0.2
+
+# Recent search results keyed by (normalized query, limit), kept for 15 minutes
+_SEARCH_CACHE = TTLCache(maxsize=512, ttl=900)
+
+async def _fetch_page(session: aiohttp.ClientSession, query: str, page: int) -> Optional[List[dict]]:
     """
-    Searches using the hosted SearxNG instance and returns a list of dictionaries with 'url' and 'content'.
+    Fetches one SearxNG result page. Returns None on error or non-200 status.
     """
-    # Mimic a real browser to avoid 403 Forbidden on some instances
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+    params = {
+        "q": query,
+        "format": "json",
+        "pageno": page
     }
 
+    logger.debug("Querying SearxNG (Page %s): %s?q=%s&format=json&pageno=%s", page, SEARXNG_URL, query, page)
+    try:
+        async with session.get(SEARXNG_URL, params=params, headers=HEADERS, timeout=aiohttp.ClientTimeout(total=10)) as response:
+            if response.status != 200:
+                logger.warning("SearxNG returned status %s", response.status)
+                return None
+
+            data = orjson.loads(await response.read())
+        return data.get("results", [])
+    except Exception as e:
+        logger.warning("Error on page %s: %s", page, e)
+        return None
+
+async def search_google(query: str, limit: int = 10) -> List[dict]:
+    """
+    Searches using the hosted SearxNG instance and returns a list of dictionaries with 'url' and 'content'.
+    Pages are requested concurrently in waves sized to the results still needed, then merged in page order;
+    no further wave is scheduled once a page yields mostly already-seen URLs.
+    Non-empty results are cached briefly so repeated queries skip SearxNG.
+    """
+    cache_key = (" ".join(query.casefold().split()), limit)
+    cached = _SEARCH_CACHE.get(cache_key)
+    if cached is not None:
+        logger.debug("SearxNG cache hit for: %s", query)
+        return list(cached)
+
+    session = get_session()
+
     try:
         search_results = []
+        # Canonical URLs already returned, so tracking-param/slash/fragment variants count once
         seen = set()
-        page = 1
-        max_pages = 6  # Safety limit
+        next_page = 1
+        exhausted = False
         
-        while len(search_results) < limit and page <= max_pages:
-            params = {
-                "q": query,
-                "format": "json",
-                "pageno": page
-            }
-            
-            print(f"Querying SearxNG (Page {page}): {SEARXNG_URL}?q={query}&format=json&pageno={page}")
-            try:
-                response = requests.get(SEARXNG_URL, params=params, headers=headers, timeout=10)
-                if response.status_code != 200:
-                    print(f"SearxNG returned status {response.status_code}")
-                    break
-                    
-                data = response.json()
-                results = data.get("results", [])
-                
+        while not exhausted and len(search_results) < limit and next_page <= MAX_PAGES:
+            needed = limit - len(search_results)
+            pages = range(next_page, min(MAX_PAGES, next_page + math.ceil(needed / RESULTS_PER_PAGE) - 1) + 1)
+            next_page = pages[-1] + 1
+            wave = await asyncio.gather(*(_fetch_page(session, query, page) for page in pages))
+
+            for results in wave:
+                # Error or empty page: later pages of this wave would be out of order or empty too
                 if not results:
+                    exhausted = True
                     break
                 
                 new_results_count = 0
                 for result in results:
                     url = result.get("url")
                     content = result.get("content", "")
-                    if url and url not in seen:
+                    if not url:
+                        continue
+                    key = canonicalize_url(url) or url
+                    if key not in seen:
                         search_results.append({"url": url, "content": content})
-                        seen.add(url)
+                        seen.add(key)
                         new_results_count += 1
                         
-                if new_results_count == 0:
-                     print("No new unique results found, stopping pagination.")
-                     break
-                     
-                page += 1
-                
-            except Exception as e:
-                print(f"Error on page {page}: {e}")
-                break
+                # Mostly repeats: the engines have run dry, so schedule no further pages.
+                # Pages already fetched in this wave are still merged
+                if new_results_count < MIN_NEW_RATIO * len(results):
+                    logger.debug("Only %s/%s new results on a page, stopping pagination.", new_results_count, len(results))
+                    exhausted = True
                     
-        print(f"SearxNG found {len(search_results)} URLs total")
-        return search_results[:limit]
+        logger.debug("SearxNG found %s URLs total", len(search_results))
+        search_results = search_results[:limit]
+        if search_results:
+            _SEARCH_CACHE.set(cache_key, search_results)
+        return list(search_results)
 
     except Exception as e:
-        print(f"Error querying SearxNG: {e}")
+        logger.warning("Error querying SearxNG: %s", e)
         return []
@@ -0,0 +1,24 @@
+from urllib.parse import urlsplit, urlunsplit
+
+# Query parameters that only track the click, never change the page
+TRACKING_PARAMS = frozenset({"gclid", "fbclid", "mc_cid", "mc_eid"})
+
+def _is_tracking_param(pair: str) -> bool:
+    key = pair.split("=", 1)[0].lower()
+    return key.startswith("utm_") or key in TRACKING_PARAMS
+
+def canonicalize_url(url: str) -> str:
+    """
+    Canonical form used to detect duplicate URLs: lowercase scheme and host, no fragment,
+    no tracking parameters (utm_*, gclid, ...) and no trailing slash ("/" for an empty path).
+    Returns "" for unparsable or host-less input.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return ""
+    if not parts.netloc:
+        return ""
+    query = "&".join(pair for pair in parts.query.split("&") if pair and not _is_tracking_param(pair))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
@@ -7,6 +7,7 @@ function App() {
   const [query, setQuery] = useState('')
   const [country, setCountry] = useState('')
   const [results, setResults] = useState([])
+  const [resultId, setResultId] = useState(null)
   const [logs, setLogs] = useState([])
   const [isSearching, setIsSearching] = useState(false)
   const [isEnriching, setIsEnriching] = useState(false)
@@ -33,6 +34,7 @@ function App() {
     }
     setIsSearching(true)
     setResults([])
+    setResultId(null)
     setLogs([]) // Clear previous logs
 
     const response = await fetch(`${API_URL}/search`, {
@@ -55,7 +57,9 @@ function App() {
           try {
             const data = JSON.parse(line.slice(6));
 
-            if (data.type === 'status' || data.type === 'error') {
+            if (data.type === 'result_id') {
+              setResultId(data.result_id);
+            } else if (data.type === 'status' || data.type === 'error') {
               setLogs(prev => [...prev, data.message]);
             } else if (data.type === 'company') {
               setResults(prev => [...prev, data.data]);
@@ -90,13 +94,15 @@ function App() {
       const { value, done } = await reader.read();
       if (done) break;
 
-      const lines = value.split('\\n\\n');
+      const lines = value.split('\n\n');
       for (const line of lines) {
         if (line.startsWith('data: ')) {
           try {
             const data = JSON.parse(line.slice(6));
 
-            if (data.type === 'status') {
+            if (data.type === 'result_id') {
+              setResultId(data.result_id);
+            } else if (data.type === 'status') {
               setLogs(prev => [...prev, data.message]);
             } else if (data.type === 'company') {
               enrichedResults.push(data.data);
@@ -167,8 +173,12 @@ function App() {
               <button onClick={handleEnrich} disabled={isEnriching || isSearching} className="btn enrich-btn">
                 {isEnriching ? 'Enriching...' : 'Enrich Results'}
               </button>
-              <a href={`${API_URL}/download/csv`} target="_blank" className="btn download-btn">Download CSV</a>
-              <a href={`${API_URL}/download/json`} target="_blank" className="btn download-btn">Download JSON</a>
+              {resultId && (
+                <>
+                  <a href={`${API_URL}/download/${resultId}/csv`} target="_blank" className="btn download-btn">Download CSV</a>
+                  <a href={`${API_URL}/download/${resultId}/json`} target="_blank" className="btn download-btn">Download JSON</a>
+                </>
+              )}
             </div>
           </div>
 